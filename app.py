@@ -1,356 +1,3646 @@
+import io
 import os
+import re
+import csv
+import gzip
 import json
-from flask import Flask, request, jsonify, send_from_directory, render_template_string, redirect, url_for, session, flash
+import math
+import mimetypes
+import atexit
+import base64
+import hashlib
+import secrets
+import queue
+import zipfile
+import multiprocessing
+import select
+import logging
+import functools
+import itertools
+from flask import Blueprint, Flask, Response, request, jsonify, render_template, make_response, redirect, url_for, session, flash, current_app, has_request_context, has_app_context, g
+from flask import json as flask_json
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo
+from email_validator import EmailNotValidError, validate_email
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from types import MappingProxyType
+import click
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.errors import FeatureNotSupported, InvalidSqlStatementName
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as pg_connection, cursor as pg_cursor
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import datetime
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-CORS(app)
+try:
+    import brotli
+except ImportError:  # optional: without it pages are offered gzipped only
+    brotli = None
+
+try:
+    import reports
+except ImportError:  # optional ("reports" extra): without it class PDF reports are unavailable
+    reports = None
+
+logger = logging.getLogger(__name__)
+
+def env_flag(name, default='false'):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+# Default configuration, read from the environment; create_app(config) overrides any of it
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    DEBUG = env_flag('FLASK_DEBUG')
+    PG_POOL_MIN = int(os.getenv('PG_POOL_MIN', '1'))
+    PG_POOL_MAX = int(os.getenv('PG_POOL_MAX', '10'))
+    PG_POOL_IDLE_TIMEOUT = float(os.getenv('PG_POOL_IDLE_TIMEOUT', '300'))
+    PG_POOL_TIMEOUT = float(os.getenv('PG_POOL_TIMEOUT', '10'))
+    PG_POOL_HEALTH_CHECK_AFTER = float(os.getenv('PG_POOL_HEALTH_CHECK_AFTER', '30'))
+    # Prepare the hot-path statements on each pooled connection; turn off behind a
+    # pooler that doesn't keep sessions (PgBouncer in transaction mode)
+    PG_PREPARED_STATEMENTS = env_flag('PG_PREPARED_STATEMENTS', 'true')
+    # Read replicas for the read-only endpoints: libpq DSNs or URLs separated by ';'.
+    # Settings missing from a DSN fall back to the PG* environment variables.
+    PG_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv('PG_REPLICA_DSNS', '').split(';') if dsn.strip()]
+    # Seconds a replica that failed is skipped before being tried again
+    PG_REPLICA_RETRY_AFTER = float(os.getenv('PG_REPLICA_RETRY_AFTER', '30'))
+    # Seconds after a write during which the same session reads from the primary
+    READ_YOUR_WRITES_WINDOW = float(os.getenv('READ_YOUR_WRITES_WINDOW', '5'))
+    # Startup schema check: 'warn' logs pending migrations or missing indexes,
+    # 'strict' refuses to start, 'off' skips it
+    SCHEMA_CHECK = os.getenv('SCHEMA_CHECK', 'warn').lower()
+    # student_responses partitions (one per half-year term) created ahead of the current one
+    RESPONSE_PARTITIONS_AHEAD = int(os.getenv('RESPONSE_PARTITIONS_AHEAD', '2'))
+    # Where `flask archive-term` writes detached terms
+    RESPONSE_ARCHIVE_DIR = os.getenv('RESPONSE_ARCHIVE_DIR', 'archive')
+    # Log requests slower than this many milliseconds with the SQL they ran (0 = off)
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '0'))
+    # When set, /metrics requires "Authorization: Bearer <token>"
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+    # When enabled, a profile stored in the signed session cookie at login can fill
+    # the user cache for up to USER_CACHE_TTL seconds, so a fresh worker needs no query.
+    USER_CACHE_FROM_SESSION = env_flag('USER_CACHE_FROM_SESSION')
+    LESSON_CATALOG_MAX_AGE = float(os.getenv('LESSON_CATALOG_MAX_AGE', '300'))
+    # Class x lesson correctness matrices kept per process for the teacher analytics view
+    CLASS_MATRIX_CACHE_SIZE = int(os.getenv('CLASS_MATRIX_CACHE_SIZE', '256'))
+    # Server-side PDF reports: rendering processes, and rendered reports kept per process
+    REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', str(os.cpu_count() or 2)))
+    REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '512'))
+    # Largest number of answers accepted by a single batch save
+    MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '200'))
+    WRITE_BEHIND_WINDOW = float(os.getenv('WRITE_BEHIND_WINDOW', '0'))
+    WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '5000'))
+    # Seconds before a teacher live-update stream is closed so the dashboard reconnects
+    TEACHER_STREAM_MAX_AGE = float(os.getenv('TEACHER_STREAM_MAX_AGE', '300'))
+    # Async serving mode (asgi.py): asyncio connection pool size, and threads for the Flask routes
+    ASYNC_PG_POOL_MIN = int(os.getenv('ASYNC_PG_POOL_MIN', '1'))
+    ASYNC_PG_POOL_MAX = int(os.getenv('ASYNC_PG_POOL_MAX', '20'))
+    ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '10'))
+    # How long browsers may reuse a lesson page before revalidating its ETag
+    STATIC_PAGE_MAX_AGE = int(os.getenv('STATIC_PAGE_MAX_AGE', '3600'))
+    # Re-read a page when its file changes on disk (handy while editing lessons)
+    STATIC_PAGES_RELOAD = env_flag('STATIC_PAGES_RELOAD', os.getenv('FLASK_DEBUG', 'false'))
+    # Password hashing pool: worker threads, and how many attempts may wait for one
+    HASH_WORKERS = int(os.getenv('HASH_WORKERS', str(os.cpu_count() or 2)))
+    HASH_QUEUE_LIMIT = int(os.getenv('HASH_QUEUE_LIMIT', '64'))
+    HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', '30'))
+    # Login/registration token buckets: burst size and refill rate (attempts per second).
+    # The per-IP bucket is generous because a whole classroom often shares one address.
+    LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', '60'))
+    LOGIN_IP_RATE = float(os.getenv('LOGIN_IP_RATE', '1'))
+    LOGIN_EMAIL_BURST = int(os.getenv('LOGIN_EMAIL_BURST', '5'))
+    LOGIN_EMAIL_RATE = float(os.getenv('LOGIN_EMAIL_RATE', '0.1'))
+    # Number of proxies in front of the app whose X-Forwarded-For can be trusted
+    PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', '0'))
+
+bp = Blueprint('main', __name__, cli_group=None)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please log in to access this lesson.'
 
-# User class for Flask-Login
-class User(UserMixin):
-    def __init__(self, id, email, student_name, student_id, class_name, is_active=True):
-        self.id = id
-        self.email = email
-        self.student_name = student_name
-        self.student_id = student_id
-        self.class_name = class_name
-        self.is_active = is_active
+# User class for Flask-Login
+class User(UserMixin):
+    def __init__(self, id, email, student_name, student_id, class_name, is_active=True):
+        self.id = id
+        self.email = email
+        self.student_name = student_name
+        self.student_id = student_id
+        self.class_name = class_name
+        self._is_active = is_active
+
+    # UserMixin.is_active is a read-only property, so keep our own flag behind it
+    @property
+    def is_active(self):
+        return self._is_active
+
+    def to_profile(self):
+        return {'id': self.id, 'email': self.email, 'student_name': self.student_name,
+                'student_id': self.student_id, 'class_name': self.class_name}
+
+# In-process cache of logged-in users so @login_required doesn't hit the database
+class UserCache:
+    """Bounded LRU of User objects keyed by id; entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # id -> (user, cached_at)
+        self._invalidated = {}  # id -> wall-clock time of the last invalidation
+        self._invalidated_all = 0  # wall-clock time of the last invalidate_all()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        # Called once per process on first use, to start hearing other workers' invalidations
+        self.watch = None
+        self._watching_pid = None
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[user_id]
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def put(self, user):
+        with self._lock:
+            if self.watch is not None and self._watching_pid != os.getpid():
+                self._watching_pid = os.getpid()
+                self.watch()
+            self._entries[user.id] = (user, time.monotonic())
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self._counters['invalidations'] += 1
+            now = time.time()
+            self._invalidated[user_id] = now
+            # Session profiles older than the TTL are rejected anyway
+            for stale in [uid for uid, at in self._invalidated.items() if now - at > self.ttl]:
+                del self._invalidated[stale]
+
+    def invalidate_all(self):
+        """Forget every user, e.g. after invalidations from other workers may have been missed."""
+        with self._lock:
+            self._counters['invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._invalidated.clear()
+            self._invalidated_all = time.time()
+
+    def invalidated_since(self, user_id, timestamp):
+        with self._lock:
+            return max(self._invalidated.get(user_id, 0), self._invalidated_all) >= timestamp
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, size=len(self._entries), max_size=self.maxsize, ttl=self.ttl)
+
+user_cache = UserCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
+
+def remember_user(user):
+    """Cache a user that was just loaded or logged in and stamp its session profile."""
+    user_cache.put(user)
+    if current_app.config['USER_CACHE_FROM_SESSION']:
+        session['_user_profile'] = dict(user.to_profile(), cached_at=time.time())
+
+def invalidate_user(user_id):
+    """Drop a cached user in this process; other workers hear of it through a 'student_updated' event."""
+    user_cache.invalidate(int(user_id))
+
+def user_from_profile(profile, user_id):
+    """Trust a session-stored profile while it is younger than the cache TTL and not invalidated."""
+    cached_at = profile.get('cached_at', 0) if profile else 0
+    if (profile and profile.get('id') == user_id and time.time() - cached_at <= user_cache.ttl
+            and not user_cache.invalidated_since(user_id, cached_at)):
+        user = User(profile['id'], profile['email'], profile['student_name'],
+                    profile['student_id'], profile['class_name'])
+        user_cache.put(user)
+        return user
+    return None
+
+# The SQL constants here and below are shared with the async API in asgi.py
+ACTIVE_STUDENT_SQL = """
+    SELECT id, email, student_name, student_id, class_name, is_active
+    FROM students WHERE id = %s AND is_active = TRUE
+"""
+
+# Login also needs the hash, which nothing else reads
+LOGIN_STUDENT_SQL = """
+    SELECT id, email, student_name, student_id, class_name, password_hash
+    FROM students WHERE email = %s AND is_active = TRUE
+"""
+
+RECORD_LOGIN_SQL = "UPDATE students SET last_login = CURRENT_TIMESTAMP WHERE id = %s RETURNING last_login"
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    if current_app.config['USER_CACHE_FROM_SESSION']:
+        user = user_from_profile(session.get('_user_profile'), user_id)
+        if user is not None:
+            return user
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            user_data = query_registry.fetchone(cur, 'active_student', (user_id,))
+            if user_data:
+                user = User(*user_data)
+                remember_user(user)
+                return user
+        finally:
+            cur.close()
+    session.pop('_user_profile', None)
+    return None
+
+# Forms
+class RegistrationForm(FlaskForm):
+    email = StringField('Email', validators=[DataRequired(), Email()])
+    student_name = StringField('Full Name', validators=[DataRequired()])
+    student_id = StringField('Student ID (optional)')
+    class_name = StringField('Class/Grade (optional)')
+    password = PasswordField('Password', validators=[DataRequired()])
+    confirm_password = PasswordField('Confirm Password', 
+                                   validators=[DataRequired(), EqualTo('password')])
+    submit = SubmitField('Register')
+
+class LoginForm(FlaskForm):
+    email = StringField('Email', validators=[DataRequired(), Email()])
+    password = PasswordField('Password', validators=[DataRequired()])
+    submit = SubmitField('Log In')
+
+# Metrics: per-process counters and histograms, scraped from /metrics in the
+# Prometheus text format. Every series carries a pid label so the workers behind
+# one address show up as separate series rather than as counter resets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}    # name -> (type, help, buckets)
+        self._values = {}  # (name, sorted label items) -> float, or [bucket counts..., sum, count]
+
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @staticmethod
+    def _labels(items):
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in items) + '}'
+
+    def render(self, gauges=()):
+        """Text exposition of every series, plus ``gauges`` given as (name, help, value) triples."""
+        pid = ('pid', os.getpid())
+        with self._lock:
+            values = {key: (list(value) if isinstance(value, list) else value)
+                      for key, value in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (series_name, items), value in sorted(values.items(), key=lambda kv: kv[0]):
+                if series_name != name:
+                    continue
+                items = (pid,) + items
+                if kind == 'counter':
+                    lines.append(f'{name}{self._labels(items)} {value}')
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{self._labels(items + (("le", bound),))} {count}')
+                lines.append(f'{name}_bucket{self._labels(items + (("le", "+Inf"),))} {value[-1]}')
+                lines.append(f'{name}_sum{self._labels(items)} {value[-2]}')
+                lines.append(f'{name}_count{self._labels(items)} {value[-1]}')
+        for name, help_text, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge',
+                      f'{name}{self._labels((pid,))} {value}']
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.counter('http_requests_total', 'Requests served, by route, method and status.')
+metrics.histogram('http_request_duration_seconds', 'Time to produce a response (streams: until the body starts).')
+metrics.histogram('http_request_db_seconds', 'Time per request spent connecting to and querying Postgres.')
+metrics.histogram('http_request_queries', 'SQL statements executed per request.', QUERY_COUNT_BUCKETS)
+metrics.counter('db_queries_total', 'SQL statements executed.')
+metrics.histogram('db_query_duration_seconds', 'Time per SQL statement.')
+metrics.histogram('db_connect_duration_seconds', 'Time to open a new Postgres connection.')
+metrics.histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection to free up.')
+metrics.histogram('db_statement_duration_seconds', 'Time per registered statement, by statement name.')
+
+class RequestStats:
+    """What one request spent on the database; ``statements`` is only kept for the slow-request log."""
+    __slots__ = ('started', 'queries', 'db_time', 'pool_wait', 'statements')
+
+    def __init__(self, keep_statements=False):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.statements = [] if keep_statements else None
+
+def request_stats():
+    return g.get('request_stats') if has_app_context() else None
+
+def record_query(query, elapsed):
+    metrics.inc('db_queries_total')
+    metrics.observe('db_query_duration_seconds', elapsed)
+    stats = request_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.statements is not None:
+            stats.statements.append((elapsed, query))
+
+class TimedCursorMixin:
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+@functools.lru_cache(maxsize=None)
+def timed_cursor_class(cursor_class):
+    return type(f'Timed{cursor_class.__name__}', (TimedCursorMixin, cursor_class), {})
+
+class InstrumentedConnection(pg_connection):
+    """Times every statement, whichever cursor_factory the caller asks for."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names of the registered statements prepared in this session (None: deallocate first)
+        self.prepared_statements = set()
+
+    def cursor(self, *args, **kwargs):
+        cursor_class = kwargs.get('cursor_factory') or self.cursor_factory or pg_cursor
+        kwargs['cursor_factory'] = timed_cursor_class(cursor_class)
+        return super().cursor(*args, **kwargs)
+
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+def sql_text(query):
+    """One-line statement text for logs, with string literals masked (execute_values inlines values)."""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return SQL_STRING_LITERAL.sub("'?'", ' '.join(str(query).split()))
+
+# Query registry: the hot-path statements are declared once, with explicit column
+# lists. A pooled connection PREPAREs a statement the first time it runs it and
+# sends EXECUTE from then on, so Postgres parses and plans each statement once per
+# connection rather than on every request. Rows come back as plain tuples and are
+# mapped onto a namedtuple per statement instead of going through RealDictCursor.
+SQL_PLACEHOLDER = re.compile(r'%([s%])')
+
+class RegisteredQuery:
+    __slots__ = ('name', 'sql', 'prepare_sql', 'execute_sql', 'row_class')
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        # PREPARE wants $1, $2, ... where psycopg2 takes %s
+        numbers = itertools.count(1)
+        text = SQL_PLACEHOLDER.sub(lambda m: f'${next(numbers)}' if m.group(1) == 's' else '%', sql)
+        params = next(numbers) - 1
+        self.prepare_sql = f'PREPARE {name} AS {text}'
+        self.execute_sql = f'EXECUTE {name}' + (f" ({', '.join(['%s'] * params)})" if params else '')
+        self.row_class = None
+
+class QueryRegistry:
+    """Named statements run on pooled connections, with per-statement call counts and timings.
+
+    Fetch with a plain (tuple) cursor; rows are namedtuples named after the
+    statement's columns. With ``prepare`` off the statements are sent as text.
+    """
+
+    def __init__(self, prepare=True):
+        self.prepare = prepare
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._stats = {}  # name -> [calls, prepares, errors, total seconds, max seconds]
+
+    def register(self, name, sql):
+        self._queries[name] = RegisteredQuery(name, sql)
+        self._stats[name] = [0, 0, 0, 0.0, 0.0]
+
+    def register_all(self, queries):
+        """Register every ``name: sql`` pair of a mapping."""
+        for name, sql in queries.items():
+            self.register(name, sql)
+
+    def execute(self, cur, name, params=()):
+        query = self._queries[name]
+        conn = cur.connection
+        prepared = failed = False
+        started = time.perf_counter()
+        try:
+            if not self.prepare:
+                cur.execute(query.sql, params)
+                return
+            if conn.prepared_statements is None:
+                cur.execute('DEALLOCATE ALL')
+                conn.prepared_statements = set()
+            if name not in conn.prepared_statements:
+                cur.execute(query.prepare_sql)
+                conn.prepared_statements.add(name)
+                prepared = True
+            cur.execute(query.execute_sql, params)
+        except (InvalidSqlStatementName, FeatureNotSupported):
+            # The session lost its statements (DISCARD ALL) or a migration changed a
+            # result type; start this connection over once the caller rolls back
+            conn.prepared_statements = None
+            failed = True
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe('db_statement_duration_seconds', elapsed, statement=name)
+            with self._lock:
+                stats = self._stats[name]
+                stats[0] += 1
+                stats[1] += prepared
+                stats[2] += failed
+                stats[3] += elapsed
+                stats[4] = max(stats[4], elapsed)
+
+    def _row_class(self, name, cur):
+        query = self._queries[name]
+        if query.row_class is None:
+            query.row_class = namedtuple(f'{name.title().replace("_", "")}Row',
+                                         [column.name for column in cur.description])
+        return query.row_class
+
+    def fetchone(self, cur, name, params=()):
+        self.execute(cur, name, params)
+        row = cur.fetchone()
+        return None if row is None else self._row_class(name, cur)._make(row)
+
+    def fetchall(self, cur, name, params=()):
+        self.execute(cur, name, params)
+        row_class = self._row_class(name, cur)
+        return [row_class._make(row) for row in cur.fetchall()]
+
+    def stats(self):
+        with self._lock:
+            return {name: {'calls': calls, 'prepares': prepares, 'errors': errors,
+                           'total_ms': round(total * 1000, 3),
+                           'mean_ms': round(total * 1000 / calls, 3) if calls else None,
+                           'max_ms': round(longest * 1000, 3)}
+                    for name, (calls, prepares, errors, total, longest) in self._stats.items()}
+
+query_registry = QueryRegistry(prepare=Config.PG_PREPARED_STATEMENTS)
+
+# Database connection pool
+class PoolExhausted(Exception):
+    """Raised when no pooled connection frees up within the checkout timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Connections are health-checked on checkout once they have sat idle for a
+    while, rolled back on return, and closed when idle past ``idle_timeout``
+    (the pool never shrinks below ``minconn``).
+    """
+
+    def __init__(self, minconn=1, maxconn=10, idle_timeout=300, checkout_timeout=10,
+                 health_check_after=30, **conn_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._conn_kwargs = conn_kwargs
+        self._idle = deque()  # (connection, returned_at) pairs, most recent on the right
+        self._in_use = 0
+        self._cond = threading.Condition()  # RLock-backed, so helpers may re-acquire it
+        self._closed = False
+        self._counters = {'created': 0, 'closed': 0, 'checkouts': 0, 'waits': 0,
+                          'timeouts': 0, 'failed_health_checks': 0}
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        started = time.perf_counter()
+        conn = psycopg2.connect(connection_factory=InstrumentedConnection, **self._conn_kwargs)
+        elapsed = time.perf_counter() - started
+        metrics.observe('db_connect_duration_seconds', elapsed)
+        stats = request_stats()
+        if stats is not None:
+            stats.db_time += elapsed
+        with self._cond:
+            self._counters['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._counters['closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reap_idle(self, now):
+        # Oldest connections sit on the left; keep at least minconn around.
+        while len(self._idle) > self.minconn and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._discard(conn)
+
+    def getconn(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            waited = False
+            while True:
+                if self._closed:
+                    raise PoolExhausted('Connection pool is closed')
+                now = time.monotonic()
+                self._reap_idle(now)
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.maxconn:
+                    self._in_use += 1
+                    conn = None
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolExhausted('Timed out waiting for a database connection')
+                if not waited:
+                    self._counters['waits'] += 1
+                    waited = now
+                self._cond.wait(remaining)
+            self._counters['checkouts'] += 1
+        if waited:
+            wait = time.monotonic() - waited
+            metrics.observe('db_pool_wait_seconds', wait)
+            stats = request_stats()
+            if stats is not None:
+                stats.pool_wait += wait
+
+        # Connect and health-check outside the lock so other threads keep moving.
+        try:
+            if conn is not None and not self._healthy(conn, time.monotonic() - returned_at):
+                with self._cond:
+                    self._counters['failed_health_checks'] += 1
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def stats(self):
+        with self._cond:
+            return dict(self._counters, min_size=self.minconn, max_size=self.maxconn,
+                        idle=len(self._idle), in_use=self._in_use)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._discard(conn)
+            self._cond.notify_all()
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+_db_pool_settings = dict(minconn=Config.PG_POOL_MIN, maxconn=Config.PG_POOL_MAX,
+                         idle_timeout=Config.PG_POOL_IDLE_TIMEOUT, checkout_timeout=Config.PG_POOL_TIMEOUT,
+                         health_check_after=Config.PG_POOL_HEALTH_CHECK_AFTER)
+
+def db_connect_kwargs():
+    return dict(
+        host=os.getenv('PGHOST'),
+        database=os.getenv('PGDATABASE'),
+        user=os.getenv('PGUSER'),
+        password=os.getenv('PGPASSWORD'),
+        port=os.getenv('PGPORT')
+    )
+
+def get_db_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(**_db_pool_settings, **db_connect_kwargs())
+    return _db_pool
+
+def close_db_pool():
+    """Close every pooled connection, replicas included; the next get_db_pool() builds a fresh pool.
+
+    Pre-forking servers call this in the parent so no connection is shared
+    between worker processes.
+    """
+    global _db_pool
+    with _db_pool_lock:
+        pool, _db_pool = _db_pool, None
+    if pool is not None:
+        pool.closeall()
+    read_replicas.closeall()
+
+def db_connection():
+    """Borrow a pooled connection: ``with db_connection() as conn: ...``"""
+    return get_db_pool().connection()
+
+# Read replicas: read-only endpoints borrow through db_read_connection(), which
+# round-robins over the replica pools and falls back to the primary when every
+# replica is down. Writes, logins and LISTEN always use the primary.
+class ReplicaRouter:
+    """One lazily built pool per replica DSN; a replica that fails is benched for ``retry_after`` seconds."""
+
+    def __init__(self, dsns=(), retry_after=30):
+        self.dsns = list(dsns)
+        self.retry_after = retry_after
+        self._pools = {}
+        self._down_until = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._counters = {'replica_reads': 0, 'primary_fallbacks': 0, 'failovers': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.dsns)
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            start, self._next = self._next, self._next + 1
+            dsns = self.dsns[start % len(self.dsns):] + self.dsns[:start % len(self.dsns)]
+            return [dsn for dsn in dsns if self._down_until.get(dsn, 0) <= now]
+
+    def _pool(self, dsn):
+        with self._lock:
+            pool = self._pools.get(dsn)
+            if pool is None:
+                # minconn=0: an unreachable replica must not stop the pool from being built
+                pool = self._pools[dsn] = ConnectionPool(**dict(_db_pool_settings, minconn=0), dsn=dsn)
+            return pool
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def mark_down(self, dsn):
+        logger.warning('Read replica unavailable, using other servers for %ss', self.retry_after)
+        with self._lock:
+            self._down_until[dsn] = time.monotonic() + self.retry_after
+            self._counters['failovers'] += 1
+
+    @contextmanager
+    def connection(self):
+        for dsn in self._candidates():
+            pool = self._pool(dsn)
+            try:
+                conn = pool.getconn()
+            except psycopg2.OperationalError:
+                self.mark_down(dsn)
+                continue
+            except PoolExhausted:
+                continue
+            self._count('replica_reads')
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                self.mark_down(dsn)
+                raise
+            finally:
+                pool.putconn(conn, close=broken)
+            return
+        self._count('primary_fallbacks')
+        with db_connection() as conn:
+            yield conn
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return dict(self._counters, replicas=len(self.dsns),
+                        down=sum(1 for until in self._down_until.values() if until > now))
+
+    def closeall(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.closeall()
+
+read_replicas = ReplicaRouter(Config.PG_REPLICA_DSNS, retry_after=Config.PG_REPLICA_RETRY_AFTER)
+
+def note_write():
+    """Start this session's read-your-writes window (only tracked when replicas are configured)."""
+    if read_replicas.enabled and has_request_context():
+        session['_last_write'] = time.time()
+
+def wrote_recently():
+    if not has_request_context():
+        return False
+    # Buffered saves reach the primary up to one write-behind window later
+    window = current_app.config['READ_YOUR_WRITES_WINDOW'] + write_buffer.window
+    return time.time() - session.get('_last_write', 0) < window
+
+def db_read_connection():
+    """Borrow a connection for read-only queries: a replica if configured, else the primary.
+
+    A session that wrote within READ_YOUR_WRITES_WINDOW reads from the primary,
+    so a student always sees the answer they just saved.
+    """
+    if not read_replicas.enabled or wrote_recently():
+        return db_connection()
+    return read_replicas.connection()
+
+# Lesson catalog: the lessons table is tiny and rarely changes, so keep it in memory
+Lesson = namedtuple('Lesson', 'id slug title')
+
+class LessonCatalog:
+    """Immutable slug/id -> Lesson mappings, reloaded on demand or every ``max_age`` seconds."""
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._by_slug = MappingProxyType({})
+        self._by_id = MappingProxyType({})
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT id, lesson_slug, lesson_title FROM lessons")
+                lessons = [Lesson(*row) for row in cur.fetchall()]
+            finally:
+                cur.close()
+        # Swap in whole new mappings so readers never see a half-built catalog
+        with self._lock:
+            self._by_slug = MappingProxyType({lesson.slug: lesson for lesson in lessons})
+            self._by_id = MappingProxyType({lesson.id: lesson for lesson in lessons})
+            self._loaded_at = time.monotonic()
+        return len(lessons)
+
+    @property
+    def stale(self):
+        loaded_at = self._loaded_at
+        return loaded_at is None or bool(self.max_age and time.monotonic() - loaded_at > self.max_age)
+
+    def _ensure_fresh(self):
+        if self.stale:
+            self.refresh()
+
+    @property
+    def by_slug(self):
+        self._ensure_fresh()
+        return self._by_slug
+
+    @property
+    def by_id(self):
+        self._ensure_fresh()
+        return self._by_id
+
+    def get(self, slug):
+        return self.by_slug.get(slug)
+
+lesson_catalog = LessonCatalog(max_age=Config.LESSON_CATALOG_MAX_AGE)
+
+# Lesson pages: read once into memory with precompressed variants, so serving one
+# is a dictionary lookup instead of a file open, read and (proxy) compression
+StaticPage = namedtuple('StaticPage', 'mtime etag mimetype variants')
+
+class StaticPageCache:
+    """In-memory copies of the pages and stylesheet, each as identity/gzip/brotli bytes with its own ETag."""
+
+    def __init__(self, directory, names, max_age=3600, reload=False):
+        self.directory = directory
+        self.names = tuple(names)
+        self.max_age = max_age
+        self.reload = reload
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _build(self, name):
+        path = os.path.join(self.directory, name)
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, 'rb') as f:
+            body = f.read()
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        # encoding -> (bytes, etag); a compressed variant is only kept when it is smaller
+        variants = {None: (body, etag)}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            variants['gzip'] = (compressed, etag + '-gz')
+        if brotli is not None:
+            compressed = brotli.compress(body, mode=brotli.MODE_TEXT, quality=11)
+            if len(compressed) < len(body):
+                variants['br'] = (compressed, etag + '-br')
+        return StaticPage(mtime, etag, mimetypes.guess_type(name)[0], variants)
+
+    def load(self):
+        pages = {name: self._build(name) for name in self.names}
+        with self._lock:
+            self._pages = pages
+        return len(pages)
+
+    def get(self, name):
+        page = self._pages.get(name)
+        if page is None or (self.reload and os.stat(os.path.join(self.directory, name)).st_mtime_ns != page.mtime):
+            page = self._build(name)
+            with self._lock:
+                self._pages = dict(self._pages, **{name: page})
+        return page
+
+    def response(self, name):
+        """Serve ``name`` in the best encoding the client accepts, or 304 if it already has it."""
+        page = self.get(name)
+        if request.if_none_match:
+            for body, etag in page.variants.values():
+                if request.if_none_match.contains(etag):
+                    return self._tag(Response(status=304), etag)
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in page.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        body, etag = page.variants[encoding]
+        response = Response(body, mimetype=page.mimetype)
+        if encoding:
+            response.content_encoding = encoding
+        return self._tag(response, etag)
+
+    def _tag(self, response, etag):
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.private = True
+        response.cache_control.max_age = self.max_age
+        return response
+
+    def stats(self):
+        pages = self._pages
+        return {name: {encoding or 'identity': len(body) for encoding, (body, etag) in page.variants.items()}
+                for name, page in pages.items()}
+
+static_pages = StaticPageCache(os.path.dirname(os.path.abspath(__file__)),
+                               ('index.html', 'Coding.html', 'Coding_al.html', 'teacher.html', 'auth.css'),
+                               max_age=Config.STATIC_PAGE_MAX_AGE, reload=Config.STATIC_PAGES_RELOAD)
+
+# Password hashing is deliberately slow, so it runs on a small bounded pool: a burst
+# of logins queues for a few workers instead of tying up every request thread (the
+# hash functions release the GIL), and once queue_limit attempts are waiting the
+# rest are turned away straight away.
+class HashQueueFull(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, workers=2, queue_limit=64, timeout=30):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._counters = {'completed': 0, 'rejected': 0}
+
+    def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                self._counters['rejected'] += 1
+                raise HashQueueFull()
+            # Created on first use so each forked worker gets its own threads
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='password-hash')
+            self._pending += 1
+            executor = self._executor
+        try:
+            future = executor.submit(func, *args)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future.result(timeout=self.timeout)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            if future is not None:
+                self._counters['completed'] += 1
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash_many(self, passwords):
+        """Hash a batch (a roster import) on its own threads, leaving the login queue alone."""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import-hash') as executor:
+            return list(executor.map(generate_password_hash, passwords))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, pending=self._pending, workers=self.workers,
+                        queue_limit=self.queue_limit)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+password_hasher = PasswordHasher(workers=Config.HASH_WORKERS, queue_limit=Config.HASH_QUEUE_LIMIT,
+                                 timeout=Config.HASH_TIMEOUT)
+
+class RateLimiter:
+    """Token buckets per key: ``burst`` attempts at once, refilled at ``rate`` per second."""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._rejected = 0
+
+    def take(self, key):
+        """Spend one token for ``key``; returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                wait = 0
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate if self.rate else 60
+                self._rejected += 1
+            # Most recently used keys live at the end; forget the idlest beyond max_keys
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'rejected': self._rejected,
+                    'rate': self.rate, 'burst': self.burst}
+
+ip_limiter = RateLimiter(Config.LOGIN_IP_RATE, Config.LOGIN_IP_BURST)
+email_limiter = RateLimiter(Config.LOGIN_EMAIL_RATE, Config.LOGIN_EMAIL_BURST)
+
+def throttle_auth(email):
+    """Charge a login/registration attempt to the client's IP and email; returns seconds to wait, or 0."""
+    return (ip_limiter.take(request.remote_addr)
+            or email_limiter.take((email or '').strip().lower()))
+
+def auth_error_page(name, form, message, status, retry_after):
+    flash(message, 'error')
+    response = make_response(render_auth_page(name, form), status)
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+# Registration page
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    form = RegistrationForm()
+    if form.validate_on_submit():
+        wait = throttle_auth(form.email.data)
+        if wait:
+            return auth_error_page('register', form, 'Too many attempts. Please wait a moment and try again.', 429, wait)
+
+        try:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                try:
+                    # Check if email already exists
+                    cur.execute("SELECT id FROM students WHERE email = %s", (form.email.data,))
+                    email_taken = cur.fetchone() is not None
+                finally:
+                    cur.close()
+            if email_taken:
+                flash('Email already registered. Please log in instead.', 'error')
+                return redirect(url_for('main.login'))
+
+            # Hash with no connection checked out; a duplicate that slips in meanwhile
+            # fails the unique constraint below
+            password_hash = password_hasher.hash(form.password.data)
+        except HashQueueFull:
+            return auth_error_page('register', form, 'Lots of students are signing in right now. Please try again in a moment.', 503, 1)
+        except Exception as e:
+            flash('Registration failed. Please try again.', 'error')
+            return render_auth_page('register', form)
+
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                # Create new user
+                cur.execute("""
+                    INSERT INTO students (email, student_name, student_id, class_name, password_hash)
+                    VALUES (%s, %s, %s, %s, %s) RETURNING id, created_at
+                """, (form.email.data, form.student_name.data, form.student_id.data or '', 
+                      form.class_name.data or '', password_hash))
+
+                user_id, created_at = cur.fetchone()
+                publish_teacher_event(cur, 'student_registered', student_id=user_id, student={
+                    'id': user_id, 'email': form.email.data, 'student_name': form.student_name.data,
+                    'student_id': form.student_id.data or '', 'class_name': form.class_name.data or '',
+                    'created_at': created_at, 'last_login': None, 'lessons_started': 0,
+                    'total_responses': 0, 'correct_responses': 0, 'last_activity': None})
+                conn.commit()
+                bump_data_version(conn)
+                note_write()
+
+                # Log the user in
+                user = User(user_id, form.email.data, form.student_name.data, 
+                           form.student_id.data or '', form.class_name.data or '')
+                login_user(user)
+                remember_user(user)
+
+                flash('Registration successful! Welcome to the Programming Fundamentals course.', 'success')
+                return redirect(url_for('main.index'))
+
+            except Exception as e:
+                conn.rollback()
+                flash('Registration failed. Please try again.', 'error')
+            finally:
+                cur.close()
+    
+    return render_auth_page('register', form)
+
+# Login page
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    form = LoginForm()
+    if form.validate_on_submit():
+        wait = throttle_auth(form.email.data)
+        if wait:
+            return auth_error_page('login', form, 'Too many login attempts. Please wait a moment and try again.', 429, wait)
+
+        try:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                try:
+                    user_data = query_registry.fetchone(cur, 'login_student', (form.email.data,))
+                finally:
+                    cur.close()
+
+            # The connection is back in the pool while the hash is checked
+            if user_data and password_hasher.check(user_data.password_hash, form.password.data):
+                with db_connection() as conn:
+                    cur = conn.cursor()
+                    try:
+                        # Update last login
+                        login_row = query_registry.fetchone(cur, 'record_login', (user_data.id,))
+                        publish_teacher_event(cur, 'student_logged_in', student_id=user_data.id,
+                                              last_login=login_row.last_login)
+                        conn.commit()
+                        bump_data_version(conn)
+                    finally:
+                        cur.close()
+
+                user = User(user_data.id, user_data.email, user_data.student_name,
+                           user_data.student_id, user_data.class_name)
+                login_user(user)
+                remember_user(user)
+
+                flash(f'Welcome back, {user.student_name}!', 'success')
+                return redirect(url_for('main.index'))
+            else:
+                flash('Invalid email or password.', 'error')
+
+        except HashQueueFull:
+            return auth_error_page('login', form, 'Lots of students are signing in right now. Please try again in a moment.', 503, 1)
+        except Exception as e:
+            flash('Login failed. Please try again.', 'error')
+    
+    return render_auth_page('login', form)
+
+# Logout
+@bp.route('/logout')
+@login_required
+def logout():
+    invalidate_user(current_user.id)
+    session.pop('_user_profile', None)
+    logout_user()
+    flash('You have been logged out.', 'info')
+    return redirect(url_for('main.login'))
+
+# Serve specific HTML files - now with authentication, from the in-memory page cache
+@bp.route('/')
+def index():
+    if current_user.is_authenticated:
+        return static_pages.response('index.html')
+    else:
+        return redirect(url_for('main.login'))
+
+@bp.route('/index.html')
+@login_required
+def index_html():
+    return static_pages.response('index.html')
+
+@bp.route('/Coding.html')
+@login_required
+def coding_html():
+    return static_pages.response('Coding.html')
+
+@bp.route('/Coding_al.html')
+@login_required
+def coding_al_html():
+    return static_pages.response('Coding_al.html')
+
+@bp.route('/teacher.html')
+def teacher_html():
+    return static_pages.response('teacher.html')
+
+# Stylesheet shared by the login and registration pages
+@bp.route('/auth.css')
+def auth_stylesheet():
+    return static_pages.response('auth.css')
+
+# API Health Check endpoint
+@bp.route('/api', methods=['GET', 'HEAD'])
+def api_health():
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'service': 'Programming Fundamentals Educational Platform',
+        'db_pool': _db_pool.stats() if _db_pool is not None else None,
+        'queries': query_registry.stats(),
+        'user_cache': user_cache.stats(),
+        'class_matrices': class_matrices.stats(),
+        'class_reports': dict(report_cache.stats(), workers=report_renderer.workers) if reports else None,
+        'teacher_stream_subscribers': teacher_events.subscriber_count(),
+        'write_behind': write_buffer.stats(),
+        'read_replicas': read_replicas.stats() if read_replicas.enabled else None,
+        'static_pages': static_pages.stats(),
+        'password_hasher': password_hasher.stats(),
+        'login_limits': {'ip': ip_limiter.stats(), 'email': email_limiter.stats()}
+    })
+
+# Request instrumentation: latency, DB time and query count per route template
+@bp.before_app_request
+def start_request_stats():
+    g.request_stats = RequestStats(keep_statements=current_app.config['SLOW_REQUEST_MS'] > 0)
+
+def finish_request_stats(status):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - stats.started
+    # The rule, not the path, so ids and slugs don't explode the label set
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.inc('http_requests_total', method=request.method, route=route, status=status)
+    metrics.observe('http_request_duration_seconds', elapsed, method=request.method, route=route)
+    metrics.observe('http_request_db_seconds', stats.db_time, route=route)
+    metrics.observe('http_request_queries', stats.queries, route=route)
+
+    slow_ms = current_app.config['SLOW_REQUEST_MS']
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        # Statement text only: parameters and literals can hold answers and password hashes
+        statements = ''.join(f'\n  {duration * 1000:8.1f}ms  {sql_text(query)[:500]}'
+                             for duration, query in stats.statements)
+        logger.warning('Slow request: %s %s -> %s in %.1fms (db %.1fms over %d queries, pool wait %.1fms)%s',
+                       request.method, request.full_path.rstrip('?'), status, elapsed * 1000,
+                       stats.db_time * 1000, stats.queries, stats.pool_wait * 1000, statements)
+
+@bp.after_app_request
+def record_request_stats(response):
+    finish_request_stats(response.status_code)
+    return response
+
+@bp.teardown_app_request
+def record_failed_request_stats(exc):
+    # Only reached with stats still set when no response was produced
+    if exc is not None:
+        finish_request_stats(500)
+
+# Prometheus scrape endpoint (metrics are per worker process, labelled with its pid)
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Authentication required'}), 401
+    pool_stats = _db_pool.stats() if _db_pool is not None else {}
+    cache_stats = user_cache.stats()
+    buffer_stats = write_buffer.stats()
+    hasher_stats = password_hasher.stats()
+    gauges = [
+        ('db_pool_connections_in_use', 'Pooled primary connections checked out.', pool_stats.get('in_use', 0)),
+        ('db_pool_connections_idle', 'Pooled primary connections idle.', pool_stats.get('idle', 0)),
+        ('db_pool_checkout_timeouts', 'Checkouts that gave up waiting (since the pool was built).', pool_stats.get('timeouts', 0)),
+        ('user_cache_hits', 'User cache hits since start.', cache_stats['hits']),
+        ('user_cache_misses', 'User cache misses since start.', cache_stats['misses']),
+        ('write_behind_pending', 'Autosaves buffered and not yet written.', buffer_stats['pending']),
+        ('password_hash_pending', 'Password hashes queued or running.', hasher_stats['pending']),
+        ('password_hash_rejected', 'Logins turned away because the hash queue was full.', hasher_stats['rejected']),
+        ('teacher_stream_subscribers', 'Open teacher live-update streams.', teacher_events.subscriber_count()),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# Get current user info for JavaScript
+@bp.route('/api/user/current', methods=['GET'])
+@login_required
+def get_current_user():
+    return jsonify({
+        'id': current_user.id,
+        'email': current_user.email,
+        'student_name': current_user.student_name,
+        'student_id': current_user.student_id,
+        'class_name': current_user.class_name
+    })
+
+def serialize_answer(student_answer):
+    """Encode an answer for the JSONB column: the JSON text goes in as an untyped literal."""
+    return json.dumps(student_answer) if student_answer is not None else None
+
+# Per-student progress summary, kept current by every save so the teacher roster
+# reads one row per student instead of aggregating all of student_responses
+SUMMARY_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS student_progress_summary (
+        student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+        lessons_started INTEGER NOT NULL DEFAULT 0,
+        total_responses INTEGER NOT NULL DEFAULT 0,
+        correct_responses INTEGER NOT NULL DEFAULT 0,
+        last_activity TIMESTAMP
+    )
+"""
+
+# Global data version, advanced after every committed write; roster ETags are built from it
+DATA_VERSION_DDL = "CREATE SEQUENCE IF NOT EXISTS data_version_seq"
+
+LOCK_SUMMARY_SQL = """
+    INSERT INTO student_progress_summary (student_id) VALUES (%s)
+    ON CONFLICT (student_id) DO UPDATE SET student_id = EXCLUDED.student_id
+"""
+
+def lock_student_summary(cur, student_id):
+    """Take the student's summary row lock before writing their responses.
+
+    Concurrent saves for one student then queue up here, so each recount
+    below sees every response committed before it.
+    """
+    query_registry.execute(cur, 'lock_summary', (student_id,))
+
+REFRESH_SUMMARY_SQL = """
+    UPDATE student_progress_summary ps SET
+        lessons_started = agg.lessons_started,
+        total_responses = agg.total_responses,
+        correct_responses = agg.correct_responses,
+        last_activity = agg.last_activity
+    FROM (
+        SELECT COUNT(DISTINCT lesson_id) AS lessons_started,
+               COUNT(*) AS total_responses,
+               COUNT(*) FILTER (WHERE is_correct) AS correct_responses,
+               MAX(updated_at) AS last_activity
+        FROM student_responses WHERE student_id = %s
+    ) agg
+    WHERE ps.student_id = %s
+    RETURNING ps.lessons_started, ps.total_responses, ps.correct_responses, ps.last_activity
+"""
+
+def refresh_student_summary(cur, student_id):
+    """Recount one student's aggregates (an index range scan on student_id)."""
+    row = query_registry.fetchone(cur, 'refresh_summary', (student_id, student_id))
+    return row._asdict() if row else None
+
+SUMMARY_BACKFILL_SQL = """
+    INSERT INTO student_progress_summary
+        (student_id, lessons_started, total_responses, correct_responses, last_activity)
+    SELECT student_id, COUNT(DISTINCT lesson_id), COUNT(*),
+           COUNT(*) FILTER (WHERE is_correct), MAX(updated_at)
+    FROM student_responses
+    GROUP BY student_id
+    ON CONFLICT (student_id) DO NOTHING
+"""
+
+@bp.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Create student_progress_summary and data_version_seq if needed and backfill the summaries."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(SUMMARY_TABLE_DDL)
+            cur.execute(DATA_VERSION_DDL)
+            cur.execute("TRUNCATE student_progress_summary")
+            cur.execute(SUMMARY_BACKFILL_SQL)
+            rebuilt = cur.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        bump_data_version(conn)
+    click.echo(f'Rebuilt progress summaries for {rebuilt} students.')
+
+# Conditional GET support: cheap version stamps let unchanged data answer 304
+BUMP_DATA_VERSION_SQL = "SELECT nextval('data_version_seq')"
+
+def bump_data_version(conn):
+    """Advance the global data version; call after commit so no reader sees the new stamp with old data."""
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            query_registry.execute(cur, 'bump_data_version')
+    finally:
+        conn.autocommit = False
+
+# A standby only sees sequence values as WAL-logged (in steps of 32), so there the
+# replay position stands in: it moves whenever any replicated data changes
+READ_DATA_VERSION_SQL = """
+    SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()::text
+                ELSE (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM data_version_seq)::text
+           END AS data_version
+"""
+
+def read_data_version(conn):
+    with conn.cursor() as cur:
+        return query_registry.fetchone(cur, 'read_data_version').data_version
+
+def make_etag(*stamp):
+    return hashlib.sha1(repr(stamp).encode()).hexdigest()
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the request's validators match, else None."""
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    else:
+        matched = (last_modified is not None and request.if_modified_since is not None
+                   and last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None))
+    if not matched:
+        return None
+    response = Response(status=304)
+    return tag_response(response, etag, last_modified)
+
+def tag_response(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Per-user data: let the browser keep it, but revalidate every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+STUDENT_STAMP_SQL = """
+    SELECT total_responses, last_activity FROM student_progress_summary WHERE student_id = %s
+"""
+
+def student_stamp(cur, student_id):
+    """(total_responses, last_activity) for one student, from their summary row."""
+    row = query_registry.fetchone(cur, 'student_stamp', (student_id,))
+    if row is None:
+        return 0, None
+    return row.total_responses, row.last_activity
+
+# Live teacher dashboard: writers publish with pg_notify inside their transaction
+# (delivered only on commit) and one shared LISTEN connection per process fans
+# the events out to every open /api/teacher/stream.
+TEACHER_EVENTS_CHANNEL = 'teacher_events'
+
+PUBLISH_EVENT_SQL = "SELECT pg_notify(%s, %s)"
+
+def teacher_event_params(event_type, **payload):
+    return TEACHER_EVENTS_CHANNEL, flask_json.dumps(dict(payload, type=event_type))
+
+def publish_teacher_event(cur, event_type, **payload):
+    """Queue a dashboard event; it is sent when the surrounding transaction commits."""
+    query_registry.execute(cur, 'publish_event', teacher_event_params(event_type, **payload))
+
+class TeacherEventHub:
+    """Fans NOTIFY payloads from a single LISTEN connection out to subscriber queues and listeners."""
+
+    def __init__(self, channel, queue_size=256, poll_interval=5, max_age=300):
+        self.channel = channel
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.max_age = max_age  # seconds a subscriber stays connected before it is told to reconnect
+        self._subscribers = set()
+        self._listeners = []  # callbacks that keep the connection open for the life of the process
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def _ensure_thread(self):
+        # Called with the lock held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name='teacher-events', daemon=True)
+            self._thread.start()
+
+    def subscribe(self):
+        """A queue of payloads; ``None`` means the stream should end."""
+        events = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self._closed:
+                events.put_nowait(None)
+                return events
+            self._subscribers.add(events)
+            self._ensure_thread()
+        return events
+
+    def add_listener(self, callback):
+        """Call ``callback(payload)`` in the listener thread for every event, resyncs included."""
+        with self._lock:
+            self._listeners.append(callback)
+            self._ensure_thread()
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.discard(events)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _broadcast(self, payload):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception('Teacher event listener failed')
+        for events in subscribers:
+            try:
+                events.put_nowait(payload)
+            except queue.Full:
+                # A client that fell behind has lost deltas; tell it to reload instead
+                with events.mutex:
+                    events.queue.clear()
+                events.put_nowait(json.dumps({'type': 'resync'}))
+
+    def close(self):
+        """End every open stream and stop listening (graceful shutdown)."""
+        with self._lock:
+            self._closed = True
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            with events.mutex:
+                events.queue.clear()
+            events.put_nowait(None)
+
+    def _listen(self):
+        conn = None
+        while True:
+            with self._lock:
+                if self._closed or (not self._subscribers and not self._listeners):
+                    self._thread = None
+                    break
+            try:
+                if conn is None:
+                    conn = psycopg2.connect(**db_connect_kwargs())
+                    conn.autocommit = True
+                    with conn.cursor() as cur:
+                        cur.execute(f'LISTEN {self.channel}')
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._broadcast(conn.notifies.pop(0).payload)
+            except psycopg2.Error:
+                # Lost the listener; tell clients to reload, then reconnect
+                self._broadcast(json.dumps({'type': 'resync'}))
+                if conn is not None:
+                    conn.close()
+                conn = None
+                time.sleep(self.poll_interval)
+        if conn is not None:
+            conn.close()
+
+teacher_events = TeacherEventHub(TEACHER_EVENTS_CHANNEL)
+
+# Every worker caches users, so a deactivation or profile change is announced to all
+# of them; if the listener lost its connection, any event may have been missed.
+def apply_user_event(payload):
+    event = json.loads(payload)
+    if event.get('type') == 'student_updated':
+        user_cache.invalidate(int(event['student_id']))
+    elif event.get('type') == 'resync':
+        user_cache.invalidate_all()
+
+user_cache.watch = lambda: teacher_events.add_listener(apply_user_event)
+
+# Seconds between SSE keep-alive comments, so proxies don't drop idle streams
+SSE_HEARTBEAT_INTERVAL = 15
+
+# {values} is one "(%s, %s, %s, %s, %s, %s)" per row, or %s for execute_values.
+# Each question keeps a single row, in the term it was last saved: an answer
+# last saved in an earlier term moves into the current one (keeping its id and
+# created_at) instead of gaining a second row there.
+UPSERT_RESPONSES_SQL = """
+    WITH saved (student_id, lesson_id, question_type, question_id, student_answer, is_correct) AS (
+        VALUES {values}
+    ), moved AS (
+        DELETE FROM student_responses sr
+        USING saved
+        WHERE sr.student_id = saved.student_id::integer AND sr.lesson_id = saved.lesson_id::integer
+          AND sr.question_type = saved.question_type::text AND sr.question_id = saved.question_id::text
+          AND sr.term <> response_term(CURRENT_DATE)
+        RETURNING sr.id, sr.lesson_id, sr.question_type, sr.question_id, sr.created_at
+    )
+    INSERT INTO student_responses (id, student_id, lesson_id, question_type, question_id,
+                                   student_answer, is_correct, created_at)
+    SELECT COALESCE(moved.id, nextval(pg_get_serial_sequence('student_responses', 'id'))),
+           saved.student_id::integer, saved.lesson_id::integer, saved.question_type::text,
+           saved.question_id::text, saved.student_answer::jsonb, saved.is_correct::boolean,
+           COALESCE(moved.created_at, CURRENT_TIMESTAMP)
+    FROM saved
+    LEFT JOIN moved ON moved.lesson_id = saved.lesson_id::integer
+                   AND moved.question_type = saved.question_type::text
+                   AND moved.question_id = saved.question_id::text
+    ON CONFLICT (student_id, lesson_id, question_type, question_id, term)
+    DO UPDATE SET
+        student_answer = EXCLUDED.student_answer,
+        is_correct = EXCLUDED.is_correct,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+UPSERT_ONE_RESPONSE_SQL = UPSERT_RESPONSES_SQL.format(values='(%s, %s, %s, %s, %s, %s)')
+
+def saved_lesson_slugs(rows):
+    lessons = lesson_catalog.by_id
+    return sorted({lessons[row[0]].slug for row in rows if row[0] in lessons})
+
+def write_student_responses(cur, student_id, rows):
+    """Upsert one student's (lesson_id, question_type, question_id, answer, is_correct) rows.
+
+    Takes the summary lock, writes every row with one multi-row statement,
+    refreshes the summary and publishes the dashboard event; the caller commits.
+    """
+    lock_student_summary(cur, student_id)
+    if len(rows) == 1:
+        # A single autosave, the common case, can use the prepared statement
+        query_registry.execute(cur, 'upsert_response', (student_id, *rows[0]))
+    else:
+        execute_values(cur, UPSERT_RESPONSES_SQL.format(values='%s'),
+                       [(student_id, *row) for row in rows], page_size=len(rows))
+    summary = refresh_student_summary(cur, student_id)
+    publish_teacher_event(cur, 'response_saved', student_id=student_id,
+                          lesson_slugs=saved_lesson_slugs(rows), saved=len(rows), summary=summary)
+    return summary
+
+# Write-behind autosave: with WRITE_BEHIND_WINDOW > 0, saves are acknowledged with
+# 202 straight away, rapid edits to the same answer collapse to the latest value,
+# and a background thread writes the survivors in bulk once per window. The buffer
+# is per process, so only progress reads served by the same process see buffered
+# answers; servers running several worker processes therefore switch it off.
+PendingAnswer = namedtuple('PendingAnswer', 'student_answer is_correct accepted_at seq attempts')
+
+class WriteBehindBuffer:
+    """Coalesces answers per (student, lesson, question) key and flushes them in bulk."""
+
+    def __init__(self, window=0.0, max_pending=5000, max_attempts=3):
+        self.window = window
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending = {}  # student_id -> {(lesson_id, question_type, question_id): PendingAnswer}
+        self._size = 0
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._counters = {'accepted': 0, 'coalesced': 0, 'flushed': 0, 'flushes': 0,
+                          'failed_flushes': 0, 'dropped': 0}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def require_single_process(self, processes):
+        """Turn buffering off when requests are spread over several worker processes."""
+        if self.enabled and processes > 1:
+            logger.warning('WRITE_BEHIND_WINDOW ignored: %d worker processes would not see '
+                           'each other\'s buffered saves', processes)
+            self.window = 0
+
+    def add(self, student_id, rows):
+        now = datetime.now()
+        with self._cond:
+            answers = self._pending.setdefault(student_id, {})
+            for lesson_id, question_type, question_id, student_answer, is_correct in rows:
+                key = (lesson_id, question_type, question_id)
+                self._seq += 1
+                if key in answers:
+                    self._counters['coalesced'] += 1
+                else:
+                    self._size += 1
+                answers[key] = PendingAnswer(student_answer, is_correct, now, self._seq, 0)
+                self._counters['accepted'] += 1
+            if self._thread is None and not self._stopping:
+                # Started on first use so a pre-forking server doesn't inherit the thread
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            if self._size >= self.max_pending:
+                self._cond.notify()
+
+    def pending_for(self, student_id, lesson_id):
+        """Buffered answers for one lesson as {(question_type, question_id): PendingAnswer}."""
+        with self._cond:
+            answers = self._pending.get(student_id, {})
+            return {key[1:]: answer for key, answer in answers.items() if key[0] == lesson_id}
+
+    def stamp(self, student_id):
+        """Changes whenever the student's buffered answers do; 0 when nothing is pending."""
+        with self._cond:
+            answers = self._pending.get(student_id)
+            return max(answer.seq for answer in answers.values()) if answers else 0
+
+    def flush(self):
+        with self._cond:
+            snapshot = {student_id: dict(answers) for student_id, answers in self._pending.items()}
+        if not snapshot:
+            return 0
+        written = 0
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                # One transaction per student keeps a bad row from failing everyone's saves
+                for student_id, answers in snapshot.items():
+                    rows = [(*key, answer.student_answer, answer.is_correct) for key, answer in answers.items()]
+                    try:
+                        write_student_responses(cur, student_id, rows)
+                        conn.commit()
+                    except psycopg2.Error:
+                        conn.rollback()
+                        logger.exception('Write-behind flush failed for student %s', student_id)
+                        self._retry_or_drop(student_id, answers)
+                        continue
+                    self._forget(student_id, answers)
+                    written += len(rows)
+            finally:
+                cur.close()
+            if written:
+                bump_data_version(conn)
+        with self._cond:
+            self._counters['flushes'] += 1
+            self._counters['flushed'] += written
+        return written
+
+    def _forget(self, student_id, flushed):
+        # Keep any answer that changed again while the flush was running
+        with self._cond:
+            answers = self._pending.get(student_id, {})
+            for key, answer in flushed.items():
+                if answers.get(key) is not None and answers[key].seq == answer.seq:
+                    del answers[key]
+                    self._size -= 1
+            if not answers:
+                self._pending.pop(student_id, None)
+
+    def _retry_or_drop(self, student_id, failed):
+        with self._cond:
+            self._counters['failed_flushes'] += 1
+            answers = self._pending.get(student_id, {})
+            for key, answer in failed.items():
+                current = answers.get(key)
+                if current is None or current.seq != answer.seq:
+                    continue
+                if answer.attempts + 1 >= self.max_attempts:
+                    del answers[key]
+                    self._size -= 1
+                    self._counters['dropped'] += 1
+                else:
+                    answers[key] = current._replace(attempts=answer.attempts + 1)
+            if not answers:
+                self._pending.pop(student_id, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(self.window)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Write-behind flush failed')
+            if stopping:
+                return
+
+    def close(self):
+        """Stop the worker and write out everything still pending."""
+        with self._cond:
+            self._stopping = True
+            thread = self._thread
+            self._cond.notify()
+        if thread is not None:
+            thread.join()
+        else:
+            self.flush()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._counters, pending=self._size, window=self.window)
+
+write_buffer = WriteBehindBuffer(window=Config.WRITE_BEHIND_WINDOW, max_pending=Config.WRITE_BEHIND_MAX_PENDING)
+atexit.register(write_buffer.close)
+
+def deserialize_answer(student_answer):
+    # Buffered answers are still in serialize_answer's form; stored ones arrive decoded
+    return json.loads(student_answer) if student_answer is not None else None
+
+def overlay_pending_answers(responses, student_id, lesson_id):
+    """Read-your-writes: apply buffered answers on top of the stored progress rows."""
+    pending = write_buffer.pending_for(student_id, lesson_id)
+    if not pending:
+        return responses
+    for response in responses:
+        answer = pending.pop((response['question_type'], response['question_id']), None)
+        if answer is not None:
+            response.update(student_answer=deserialize_answer(answer.student_answer),
+                            is_correct=answer.is_correct, updated_at=answer.accepted_at)
+    for (question_type, question_id), answer in pending.items():
+        responses.append({'id': None, 'student_id': student_id, 'lesson_id': lesson_id,
+                          'question_type': question_type, 'question_id': question_id,
+                          'student_answer': deserialize_answer(answer.student_answer),
+                          'is_correct': answer.is_correct,
+                          'created_at': answer.accepted_at, 'updated_at': answer.accepted_at})
+    responses.sort(key=lambda r: r['updated_at'], reverse=True)
+    return responses
+
+# Student-facing failures are logged here rather than passing driver messages back
+SAVE_FAILED_MESSAGE = 'Your answers could not be saved. Please try again.'
+LOAD_FAILED_MESSAGE = 'Your saved work could not be loaded. Please try again.'
+
+def response_item_error(item):
+    """Why a saved answer's body is unusable, or None; shared by the single and batch saves."""
+    if not isinstance(item, dict) or not all([item.get('lesson_slug'), item.get('question_type'),
+                                              item.get('question_id')]):
+        return 'Missing required fields'
+    if not isinstance(item['lesson_slug'], str) or not all(
+            isinstance(item[field], (str, int)) and not isinstance(item[field], bool)
+            for field in ('question_type', 'question_id')):
+        return 'Invalid lesson_slug, question_type or question_id'
+    return None
+
+def response_row(lesson, item):
+    """The (lesson_id, question_type, question_id, answer, is_correct) row for a validated item."""
+    # Stored as text, so 5 and '5' are the same question (and the same write-behind key)
+    return (lesson.id, str(item['question_type']), str(item['question_id']),
+            serialize_answer(item.get('student_answer')), item.get('is_correct'))
+
+def parse_response_batch(items):
+    """Validate save_batch items against the (fresh) lesson catalog.
+
+    Returns the per-item results and the rows to write, keeping the last edit
+    per question, since a multi-row upsert may not touch the same row twice.
+    """
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        error = response_item_error(item)
+        if error:
+            results[index] = {'index': index, 'success': False, 'error': error}
+        else:
+            valid.append((index, item))
+
+    rows = {}
+    for index, item in valid:
+        lesson = lesson_catalog.get(item['lesson_slug'])
+        if lesson is None:
+            results[index] = {'index': index, 'success': False, 'error': 'Lesson not found'}
+            continue
+        row = response_row(lesson, item)
+        rows[row[:3]] = row
+        results[index] = {'index': index, 'success': True}
+    return results, list(rows.values())
+
+# Save student response (now using authenticated user)
+@bp.route('/api/response/save', methods=['POST'])
+@login_required
+def save_response():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    error = response_item_error(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    lesson = lesson_catalog.get(data['lesson_slug'])
+    if not lesson:
+        return jsonify({'error': 'Lesson not found'}), 404
+
+    row = response_row(lesson, data)
+    if write_buffer.enabled:
+        write_buffer.add(current_user.id, [row])
+        note_write()
+        return jsonify({'success': True, 'queued': True}), 202
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            # UPSERT for the authenticated user
+            write_student_responses(cur, current_user.id, [row])
+            conn.commit()
+            bump_data_version(conn)
+            note_write()
+            return jsonify({'success': True})
+
+        except Exception:
+            conn.rollback()
+            logger.exception('Saving a response for student %s failed', current_user.id)
+            return jsonify({'error': SAVE_FAILED_MESSAGE}), 500
+        finally:
+            cur.close()
+
+# Save many student responses in one round trip (used by the lesson pages' autosave queue)
+@bp.route('/api/response/save_batch', methods=['POST'])
+@login_required
+def save_response_batch():
+    data = request.get_json(silent=True) or {}
+    items = data.get('responses')
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a list of responses'}), 400
+    max_batch_size = current_app.config['MAX_BATCH_SIZE']
+    if len(items) > max_batch_size:
+        return jsonify({'error': f'At most {max_batch_size} responses per batch'}), 413
+
+    results, rows = parse_response_batch(items)
+
+    status = 200
+    if rows and write_buffer.enabled:
+        write_buffer.add(current_user.id, rows)
+        note_write()
+        status = 202
+    elif rows:
+        with db_connection() as conn:
+            cur = conn.cursor()
+
+            try:
+                write_student_responses(cur, current_user.id, rows)
+                conn.commit()
+                bump_data_version(conn)
+                note_write()
+
+            except Exception:
+                conn.rollback()
+                logger.exception('Saving %s responses for student %s failed', len(rows), current_user.id)
+                return jsonify({'error': SAVE_FAILED_MESSAGE}), 500
+            finally:
+                cur.close()
+
+    return jsonify({
+        'success': all(r['success'] for r in results),
+        'saved': sum(1 for r in results if r['success']),
+        'results': results
+    }), status
+
+# The columns the progress and details APIs return (not the term or the search vector)
+RESPONSE_FIELDS_SQL = """
+    sr.id, sr.student_id, sr.lesson_id, sr.question_type, sr.question_id, sr.student_answer,
+    sr.is_correct, sr.created_at, sr.updated_at
+"""
+
+LESSON_PROGRESS_SQL = f"""
+    SELECT {RESPONSE_FIELDS_SQL} FROM student_responses sr
+    WHERE sr.student_id = %s AND sr.lesson_id = %s
+    ORDER BY sr.updated_at DESC
+"""
+
+# The statements behind login, autosave and progress reads, prepared per connection
+query_registry.register_all({
+    'active_student': ACTIVE_STUDENT_SQL,
+    'login_student': LOGIN_STUDENT_SQL,
+    'record_login': RECORD_LOGIN_SQL,
+    'lock_summary': LOCK_SUMMARY_SQL,
+    'upsert_response': UPSERT_ONE_RESPONSE_SQL,
+    'refresh_summary': REFRESH_SUMMARY_SQL,
+    'publish_event': PUBLISH_EVENT_SQL,
+    'bump_data_version': BUMP_DATA_VERSION_SQL,
+    'read_data_version': READ_DATA_VERSION_SQL,
+    'student_stamp': STUDENT_STAMP_SQL,
+    'lesson_progress': LESSON_PROGRESS_SQL,
+})
+
+# Get student progress for a lesson (now using authenticated user)
+@bp.route('/api/student/lesson/<lesson_slug>/progress', methods=['GET'])
+@login_required
+def get_student_progress(lesson_slug):
+    lesson = lesson_catalog.get(lesson_slug)
+    if not lesson:
+        return jsonify({'responses': []})
+
+    with db_read_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            total_responses, last_activity = student_stamp(cur, current_user.id)
+            buffered = write_buffer.stamp(current_user.id)
+            etag = make_etag('progress', current_user.id, lesson.id, total_responses, last_activity, buffered)
+            if buffered:
+                # Buffered answers are newer than anything the database can date
+                last_activity = None
+            cached = not_modified(etag, last_activity)
+            if cached is not None:
+                return cached
+
+            rows = query_registry.fetchall(cur, 'lesson_progress', (current_user.id, lesson.id))
+            responses = overlay_pending_answers([row._asdict() for row in rows], current_user.id, lesson.id)
+            return tag_response(jsonify({'responses': responses}), etag, last_activity)
+
+        except Exception:
+            logger.exception('Loading lesson progress for student %s failed', current_user.id)
+            return jsonify({'error': LOAD_FAILED_MESSAGE}), 500
+        finally:
+            cur.close()
+
+# Simple teacher authentication (in production, use proper session-based auth)
+def require_teacher_auth():
+    auth = request.authorization
+    if not auth or not (auth.username == 'teacher' and auth.password == 'education123'):
+        return False
+    return True
+
+# Teacher roster: sort keys allowed for keyset pagination, as (SQL expression, cast).
+# Each one is backed by an (expression, id) index created by `flask create-indexes`.
+ROSTER_SORT_KEYS = {
+    'created_at': ('s.created_at', 'timestamp'),
+    'student_name': ('lower(s.student_name)', 'text'),
+    'email': ('s.email', 'text'),
+    'last_login': ("COALESCE(s.last_login, 'epoch'::timestamp)", 'timestamp'),
+}
+ROSTER_PAGE_SIZE = 50
+ROSTER_MAX_PAGE_SIZE = 500
+
+ROSTER_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS students_created_at_id_idx ON students (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS students_lower_name_id_idx ON students (lower(student_name), id)",
+    "CREATE INDEX IF NOT EXISTS students_email_id_idx ON students (email, id)",
+    "CREATE INDEX IF NOT EXISTS students_last_login_id_idx ON students ((COALESCE(last_login, 'epoch'::timestamp)), id)",
+    "CREATE INDEX IF NOT EXISTS students_class_created_at_id_idx ON students (class_name, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS student_progress_summary_last_activity_idx ON student_progress_summary (last_activity)",
+]
+
+# Trigram indexes for the name/email search; skipped where pg_trgm isn't installed
+ROSTER_SEARCH_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS students_name_trgm_idx ON students USING gin (student_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS students_email_trgm_idx ON students USING gin (email gin_trgm_ops)",
+]
+
+@bp.cli.command('create-indexes')
+def create_indexes_command():
+    """Create the indexes behind the teacher roster's filters and sort keys."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            for statement in ROSTER_INDEX_DDL:
+                cur.execute(statement)
+            cur.execute("SAVEPOINT search_indexes")
+            try:
+                for statement in ROSTER_SEARCH_INDEX_DDL:
+                    cur.execute(statement)
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT search_indexes")
+                click.echo(f'Skipped trigram search indexes: {e.pgerror or e}'.strip(), err=True)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    click.echo('Roster indexes are in place.')
+
+# Schema migrations: `flask migrate` applies, in order, every migration not yet
+# recorded in schema_migrations, each in its own transaction. Statements are
+# idempotent (IF NOT EXISTS and friends) so a database created before the
+# migrations existed is adopted rather than recreated. Append new migrations;
+# never edit one that has shipped.
+Migration = namedtuple('Migration', 'version description statements')
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Arbitrary key for the advisory lock that keeps two migrators from overlapping
+MIGRATION_LOCK_KEY = 7482016
+
+def create_unique_index_sql(name, table, columns):
+    """Create a unique index unless the table already has one over exactly these columns
+    (e.g. from a UNIQUE constraint in an older hand-made schema)."""
+    return f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_index i
+                WHERE i.indrelid = '{table}'::regclass AND i.indisunique AND i.indexprs IS NULL
+                  AND (SELECT array_agg(a.attname::text ORDER BY a.attname)
+                       FROM pg_attribute a
+                       WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey))
+                      = (SELECT array_agg(c ORDER BY c) FROM unnest(ARRAY{list(columns)}::text[]) c)
+            ) THEN
+                CREATE UNIQUE INDEX {name} ON {table} ({', '.join(columns)});
+            END IF;
+        END $$
+    """
+
+# student_responses is range partitioned by term: half-years starting 1 January and
+# 1 July. A row's term defaults to the one it is first saved in, and a unique key
+# on a partitioned table has to include the partition key, so the save upsert
+# only ever touches the current term's (small) partition. A default partition
+# catches rows for terms nobody created; creating the term moves them across.
+PARTITION_LOCK_KEY = 7482017
+
+# Every stored column of student_responses (archive files hold exactly these)
+RESPONSE_ARCHIVE_COLUMNS = ('id', 'student_id', 'lesson_id', 'question_type', 'question_id',
+                            'student_answer', 'is_correct', 'created_at', 'updated_at', 'term')
+
+RESPONSE_TERM_FUNCTION_DDL = """
+    CREATE OR REPLACE FUNCTION response_term(day date) RETURNS date
+    LANGUAGE sql IMMUTABLE AS $$
+        SELECT make_date(extract(year FROM day)::int, CASE WHEN extract(month FROM day) < 7 THEN 1 ELSE 7 END, 1)
+    $$
+"""
+
+def ensure_partition_function_ddl(like_options='INCLUDING DEFAULTS', columns='*'):
+    """ensure_response_partition(term_start): returns the partition's name if it had to be created, else NULL."""
+    select_list = columns if columns == '*' else ', '.join(columns)
+    insert_list = '' if columns == '*' else f" ({select_list})"
+    return f"""
+    CREATE OR REPLACE FUNCTION ensure_response_partition(term_start date) RETURNS text
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        term_end date := term_start + interval '6 months';
+        partition_name text := 'student_responses_' || to_char(term_start, 'YYYY_MM');
+    BEGIN
+        IF term_start <> response_term(term_start) THEN
+            RAISE EXCEPTION '% is not the first day of a term', term_start;
+        END IF;
+        PERFORM pg_advisory_xact_lock({PARTITION_LOCK_KEY});
+        IF to_regclass(partition_name) IS NOT NULL THEN
+            RETURN NULL;
+        END IF;
+        EXECUTE format('CREATE TABLE %I (LIKE student_responses {like_options})', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM student_responses_default WHERE term >= %L AND term < %L RETURNING *) '
+                       'INSERT INTO %I{insert_list} SELECT {select_list} FROM moved', term_start, term_end, partition_name);
+        EXECUTE format('ALTER TABLE student_responses ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, term_start, term_end);
+        RETURN partition_name;
+    END $$
+"""
+
+# Rebuilds an unpartitioned student_responses as a partitioned one: rows are copied
+# into their terms' partitions before the indexes are built, and the id sequence
+# carries over. Skipped when the table is partitioned already.
+PARTITION_RESPONSES_SQL = """
+    DO $$
+    DECLARE
+        id_sequence text;
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'student_responses'::regclass) = 'p' THEN
+            RETURN;
+        END IF;
+        ALTER TABLE student_responses RENAME TO student_responses_unpartitioned;
+        CREATE TABLE student_responses (
+            id INTEGER NOT NULL,
+            student_id INTEGER REFERENCES students(id),
+            lesson_id INTEGER REFERENCES lessons(id),
+            question_type TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            student_answer TEXT,
+            is_correct BOOLEAN,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            term DATE NOT NULL DEFAULT response_term(CURRENT_DATE)
+        ) PARTITION BY RANGE (term);
+        CREATE TABLE student_responses_default PARTITION OF student_responses DEFAULT;
+
+        id_sequence := pg_get_serial_sequence('student_responses_unpartitioned', 'id');
+        IF id_sequence IS NULL THEN
+            CREATE SEQUENCE student_responses_id_seq;
+            PERFORM setval('student_responses_id_seq', COALESCE(MAX(id), 0) + 1, false)
+            FROM student_responses_unpartitioned;
+            id_sequence := 'student_responses_id_seq';
+        END IF;
+        EXECUTE format('ALTER TABLE student_responses ALTER COLUMN id SET DEFAULT nextval(%L)', id_sequence);
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY student_responses.id', id_sequence);
+
+        PERFORM ensure_response_partition(term)
+        FROM (SELECT DISTINCT response_term(COALESCE(created_at, CURRENT_TIMESTAMP)::date) AS term
+              FROM student_responses_unpartitioned
+              UNION SELECT response_term(CURRENT_DATE)) terms
+        ORDER BY term;
+        INSERT INTO student_responses (id, student_id, lesson_id, question_type, question_id,
+                                       student_answer, is_correct, created_at, updated_at, term)
+        SELECT id, student_id, lesson_id, question_type, question_id, student_answer, is_correct,
+               created_at, updated_at, response_term(COALESCE(created_at, CURRENT_TIMESTAMP)::date)
+        FROM student_responses_unpartitioned;
+        DROP TABLE student_responses_unpartitioned;
+
+        ALTER TABLE student_responses ADD PRIMARY KEY (id, term);
+        CREATE UNIQUE INDEX student_responses_answer_key
+            ON student_responses (student_id, lesson_id, question_type, question_id, term);
+        CREATE INDEX student_responses_student_updated_idx ON student_responses (student_id, updated_at);
+    END $$
+"""
+
+# Answers are stored as JSONB: strings, numbers and the structured answers
+# (matches, timelines) alike. Older rows held JSON text for structured answers and
+# raw text otherwise; anything that parses as JSON is read as JSON, which is how
+# the lesson pages already read them, and the rest becomes a JSON string.
+ANSWER_TO_JSONB_FUNCTION_DDL = """
+    CREATE OR REPLACE FUNCTION answer_to_jsonb(answer text) RETURNS jsonb
+    LANGUAGE plpgsql IMMUTABLE AS $$
+    BEGIN
+        RETURN answer::jsonb;
+    EXCEPTION WHEN invalid_text_representation THEN
+        RETURN to_jsonb(answer);
+    END $$
+"""
+
+ANSWERS_TO_JSONB_SQL = """
+    DO $$
+    BEGIN
+        IF (SELECT atttypid FROM pg_attribute
+            WHERE attrelid = 'student_responses'::regclass AND attname = 'student_answer') = 'text'::regtype THEN
+            ALTER TABLE student_responses ALTER COLUMN student_answer TYPE jsonb USING answer_to_jsonb(student_answer);
+        END IF;
+    END $$
+"""
+
+# Full-text search over every string inside an answer, kept up to date by Postgres
+ANSWER_SEARCH_COLUMN_DDL = """
+    ALTER TABLE student_responses ADD COLUMN IF NOT EXISTS answer_search tsvector
+        GENERATED ALWAYS AS (jsonb_to_tsvector('english', student_answer, '["string"]')) STORED
+"""
+
+# Saves made before answers moved between terms could leave one row per term for
+# the same question; keep the most recently saved one and recount the summaries
+DEDUPLICATE_RESPONSES_SQL = """
+    DO $$
+    DECLARE
+        removed integer;
+    BEGIN
+        DELETE FROM student_responses sr
+        USING student_responses newer
+        WHERE newer.student_id = sr.student_id AND newer.lesson_id = sr.lesson_id
+          AND newer.question_type = sr.question_type AND newer.question_id = sr.question_id
+          AND (COALESCE(newer.updated_at, '-infinity'), newer.term, newer.id)
+              > (COALESCE(sr.updated_at, '-infinity'), sr.term, sr.id);
+        GET DIAGNOSTICS removed = ROW_COUNT;
+        IF removed > 0 THEN
+            UPDATE student_progress_summary ps SET
+                lessons_started = agg.lessons_started,
+                total_responses = agg.total_responses,
+                correct_responses = agg.correct_responses,
+                last_activity = agg.last_activity
+            FROM (
+                SELECT student_id, COUNT(DISTINCT lesson_id) AS lessons_started, COUNT(*) AS total_responses,
+                       COUNT(*) FILTER (WHERE is_correct) AS correct_responses, MAX(updated_at) AS last_activity
+                FROM student_responses
+                GROUP BY student_id
+            ) agg
+            WHERE ps.student_id = agg.student_id;
+            PERFORM nextval('data_version_seq');
+        END IF;
+    END $$
+"""
+
+MIGRATIONS = [
+    Migration(1, 'Base tables, lesson rows and the indexes behind saves, logins and progress reads', [
+        """
+        CREATE TABLE IF NOT EXISTS students (
+            id SERIAL PRIMARY KEY,
+            email TEXT NOT NULL,
+            student_name TEXT NOT NULL,
+            student_id TEXT DEFAULT '',
+            class_name TEXT DEFAULT '',
+            password_hash TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS lessons (
+            id SERIAL PRIMARY KEY,
+            lesson_slug TEXT NOT NULL,
+            lesson_title TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS student_responses (
+            id SERIAL PRIMARY KEY,
+            student_id INTEGER REFERENCES students(id),
+            lesson_id INTEGER REFERENCES lessons(id),
+            question_type TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            student_answer TEXT,
+            is_correct BOOLEAN,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Login and registration look students up by email
+        create_unique_index_sql('students_email_key', 'students', ('email',)),
+        create_unique_index_sql('lessons_lesson_slug_key', 'lessons', ('lesson_slug',)),
+        # The arbiter for every save's ON CONFLICT upsert
+        create_unique_index_sql('student_responses_answer_key', 'student_responses',
+                                ('student_id', 'lesson_id', 'question_type', 'question_id')),
+        # Per-student reads ordered or aggregated by recency (progress, details, summaries)
+        "CREATE INDEX IF NOT EXISTS student_responses_student_updated_idx ON student_responses (student_id, updated_at)",
+        """
+        INSERT INTO lessons (lesson_slug, lesson_title)
+        SELECT slug, title FROM (VALUES ('coding', 'Programming Fundamentals'),
+                                        ('coding_al', 'Programming Fundamentals - Adapted Lesson')) AS v(slug, title)
+        WHERE NOT EXISTS (SELECT 1 FROM lessons WHERE lesson_slug = v.slug)
+        """,
+    ]),
+    Migration(2, 'Per-student progress summaries and the global data version', [
+        SUMMARY_TABLE_DDL,
+        DATA_VERSION_DDL,
+        SUMMARY_BACKFILL_SQL,
+    ]),
+    Migration(3, 'Teacher roster sort and filter indexes', ROSTER_INDEX_DDL),
+    Migration(4, 'Partition student_responses by term', [
+        RESPONSE_TERM_FUNCTION_DDL,
+        ensure_partition_function_ddl(),
+        PARTITION_RESPONSES_SQL,
+        "SELECT ensure_response_partition(response_term((CURRENT_DATE + interval '6 months')::date))",
+    ]),
+    Migration(5, 'JSONB answers with full-text and JSON path search indexes', [
+        ANSWER_TO_JSONB_FUNCTION_DDL,
+        ANSWERS_TO_JSONB_SQL,
+        ANSWER_SEARCH_COLUMN_DDL,
+        "CREATE INDEX IF NOT EXISTS student_responses_answer_search_idx ON student_responses USING gin (answer_search)",
+        "CREATE INDEX IF NOT EXISTS student_responses_answer_path_idx ON student_responses USING gin (student_answer jsonb_path_ops)",
+        # New partitions copy the generated column; rows moved out of the default partition can't set it
+        ensure_partition_function_ddl('INCLUDING DEFAULTS INCLUDING GENERATED', RESPONSE_ARCHIVE_COLUMNS),
+    ]),
+    Migration(6, 'One student_responses row per question across terms', [
+        DEDUPLICATE_RESPONSES_SQL,
+    ]),
+]
+
+# Indexes the hot queries depend on, as (table, columns, unique); checked at startup
+EXPECTED_INDEXES = [
+    ('students', ('email',), True),
+    ('student_responses', ('student_id', 'lesson_id', 'question_type', 'question_id', 'term'), True),
+    ('student_responses', ('student_id', 'updated_at'), False),
+    ('student_progress_summary', ('student_id',), True),
+    ('student_responses', ('answer_search',), False),
+]
+
+def applied_migrations(cur):
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return set()
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def run_migrations(echo=click.echo):
+    """Apply every pending migration in order; returns the versions applied."""
+    applied = []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(SCHEMA_MIGRATIONS_DDL)
+            conn.commit()
+            # Session-level lock: held across the per-migration commits below
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            try:
+                done = applied_migrations(cur)
+                conn.commit()
+                for migration in MIGRATIONS:
+                    if migration.version in done:
+                        continue
+                    echo(f'Applying migration {migration.version}: {migration.description}')
+                    try:
+                        for statement in migration.statements:
+                            cur.execute(statement)
+                        cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                                    (migration.version, migration.description))
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    applied.append(migration.version)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
+        finally:
+            cur.close()
+        if applied:
+            bump_data_version(conn)
+    return applied
+
+def missing_indexes(cur):
+    """EXPECTED_INDEXES entries with no matching valid index (leading columns, in order)."""
+    cur.execute("""
+        SELECT c.relname, i.indisunique,
+               ARRAY(SELECT a.attname::text
+                     FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+                     JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                     ORDER BY k.position)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        WHERE c.relname = ANY(%s) AND pg_table_is_visible(c.oid) AND i.indisvalid
+    """, (list({table for table, _, _ in EXPECTED_INDEXES}),))
+    indexes = cur.fetchall()
+    missing = []
+    for table, columns, unique in EXPECTED_INDEXES:
+        found = any(name == table and (is_unique or not unique)
+                    and (sorted(index_columns) == sorted(columns) if unique
+                         else tuple(index_columns[:len(columns)]) == columns)
+                    for name, is_unique, index_columns in indexes)
+        if not found:
+            missing.append(f"{table}({', '.join(columns)})")
+    return missing
+
+_schema_settings = {'check': Config.SCHEMA_CHECK}
+
+def check_schema():
+    """Warn (or, with SCHEMA_CHECK=strict, fail) when migrations are pending or hot-path indexes are missing."""
+    mode = _schema_settings['check']
+    if mode == 'off':
+        return []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            pending = [m.version for m in MIGRATIONS if m.version not in applied_migrations(cur)]
+            missing = missing_indexes(cur)
+        finally:
+            cur.close()
+    problems = []
+    if pending:
+        problems.append(f"pending migrations {pending}")
+    if missing:
+        problems.append(f"missing indexes {', '.join(missing)}")
+    if problems:
+        message = f"Database schema is behind: {'; '.join(problems)}. Run `flask --app app migrate`."
+        if mode == 'strict':
+            raise RuntimeError(message)
+        logger.warning(message)
+    return problems
+
+@bp.cli.command('migrate')
+@click.option('--status', is_flag=True, help='List migrations and whether each is applied, without applying any.')
+def migrate_command(status):
+    """Create or upgrade the database schema."""
+    if status:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                done = applied_migrations(cur)
+                missing = missing_indexes(cur)
+            finally:
+                cur.close()
+        for migration in MIGRATIONS:
+            state = 'applied' if migration.version in done else 'pending'
+            click.echo(f'{migration.version:>4}  {state:<8} {migration.description}')
+        for index in missing:
+            click.echo(f'Missing index: {index}', err=True)
+        return
+    applied = run_migrations()
+    click.echo(f'Applied {len(applied)} migration(s); schema is at version {MIGRATIONS[-1].version}.'
+               if applied else 'Schema is up to date.')
+
+# Response partitions: upcoming terms are created at startup (and by
+# `flask create-partitions`); past terms can be archived to compressed CSV files
+# and dropped, then restored from those files when needed.
+RESPONSE_ARCHIVE_NAME = re.compile(r'(student_responses_(\d{4})_(01|07))\.csv\.gz$')
+
+# Seconds archive/restore wait for the table lock before giving up, so a long
+# teacher export can't leave every save queued behind them
+PARTITION_LOCK_TIMEOUT = '5s'
+
+RESPONSE_PARTITIONS_SQL = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'student_responses'::regclass
+    ORDER BY c.relname
+"""
+
+LOCK_SUMMARIES_SQL = """
+    INSERT INTO student_progress_summary (student_id)
+    SELECT student_id FROM unnest(%s::int[]) AS s(student_id) ORDER BY student_id
+    ON CONFLICT (student_id) DO UPDATE SET student_id = EXCLUDED.student_id
+"""
+
+# REFRESH_SUMMARY_SQL for a set of students at once
+REFRESH_SUMMARIES_SQL = """
+    UPDATE student_progress_summary ps SET
+        lessons_started = agg.lessons_started,
+        total_responses = agg.total_responses,
+        correct_responses = agg.correct_responses,
+        last_activity = agg.last_activity
+    FROM (
+        SELECT s.student_id,
+               COUNT(DISTINCT sr.lesson_id) AS lessons_started,
+               COUNT(sr.student_id) AS total_responses,
+               COUNT(*) FILTER (WHERE sr.is_correct) AS correct_responses,
+               MAX(sr.updated_at) AS last_activity
+        FROM unnest(%s::int[]) AS s(student_id)
+        LEFT JOIN student_responses sr ON sr.student_id = s.student_id
+        GROUP BY s.student_id
+    ) agg
+    WHERE ps.student_id = agg.student_id
+"""
+
+_partition_settings = {'ahead': Config.RESPONSE_PARTITIONS_AHEAD, 'archive_dir': Config.RESPONSE_ARCHIVE_DIR}
+
+def responses_partitioned(cur):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('student_responses')")
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+def ensure_response_partitions(ahead=None):
+    """Create the current term's partition and ``ahead`` upcoming ones; returns the names created."""
+    ahead = _partition_settings['ahead'] if ahead is None else ahead
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            created = []
+            # Until migration 4 runs there is nothing to create (check_schema reports it)
+            if responses_partitioned(cur):
+                cur.execute("""
+                    SELECT ensure_response_partition(response_term((CURRENT_DATE + make_interval(months => 6 * n))::date))
+                    FROM generate_series(0, %s) n
+                """, (ahead,))
+                created = [row[0] for row in cur.fetchall() if row[0]]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    return created
+
+def parse_term(value):
+    """'2025-01' or '2025-07' (a date inside the term works too) -> the term's first day."""
+    day = datetime.fromisoformat(value if len(value) > 7 else value + '-01').date()
+    return day.replace(month=1 if day.month < 7 else 7, day=1)
+
+def term_partition(term):
+    return f"student_responses_{term:%Y_%m}"
+
+def term_end(term):
+    return term.replace(year=term.year + 1, month=1) if term.month == 7 else term.replace(month=7)
+
+@bp.cli.command('create-partitions')
+@click.option('--ahead', type=int, help='Upcoming terms to create besides the current one (default: RESPONSE_PARTITIONS_AHEAD).')
+def create_partitions_command(ahead):
+    """Create student_responses partitions for the current and upcoming terms, and list them."""
+    created = ensure_response_partitions(ahead)
+    for name in created:
+        click.echo(f'Created {name}')
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            if not responses_partitioned(cur):
+                raise click.ClickException('student_responses is not partitioned yet; run `flask --app app migrate`.')
+            cur.execute(RESPONSE_PARTITIONS_SQL)
+            partitions = cur.fetchall()
+        finally:
+            cur.close()
+    for name, bounds, estimated_rows in partitions:
+        click.echo(f'{name:<32} {bounds:<60} ~{max(int(estimated_rows), 0)} rows')
+
+@bp.cli.command('archive-term')
+@click.argument('term')
+@click.option('--dir', 'directory', help='Directory for the archive file (default: RESPONSE_ARCHIVE_DIR).')
+def archive_term_command(term, directory):
+    """Write a past TERM (e.g. 2025-01 or 2025-07) to a gzipped CSV file, then detach and drop its partition."""
+    try:
+        term = parse_term(term)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'TERM'")
+    name = term_partition(term)
+    directory = directory or _partition_settings['archive_dir']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}.csv.gz')
+    if os.path.exists(path):
+        raise click.ClickException(f'{path} already exists.')
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT response_term(CURRENT_DATE)")
+            if term >= cur.fetchone()[0]:
+                raise click.ClickException('Only past terms can be archived.')
+            cur.execute("""
+                SELECT 1 FROM pg_inherits
+                WHERE inhrelid = to_regclass(%s) AND inhparent = 'student_responses'::regclass
+            """, (name,))
+            if cur.fetchone() is None:
+                raise click.ClickException(f'There is no {name} partition to archive.')
+
+            # Copy out first: the partition stays attached until the file is safely on disk
+            partial = path + '.partial'
+            with open(partial, 'wb') as raw:
+                with gzip.GzipFile(filename=f'{name}.csv', mode='wb', fileobj=raw) as archive:
+                    cur.copy_expert(f"COPY (SELECT {', '.join(RESPONSE_ARCHIVE_COLUMNS)} FROM {name} ORDER BY id) "
+                                    "TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+                    archived = cur.rowcount
+                raw.flush()
+                os.fsync(raw.fileno())
+            conn.commit()
+
+            try:
+                cur.execute("SELECT set_config('lock_timeout', %s, true)", (PARTITION_LOCK_TIMEOUT,))
+                cur.execute(f"SELECT COUNT(*), COALESCE(array_agg(DISTINCT student_id), '{{}}') FROM {name}")
+                count, student_ids = cur.fetchone()
+                if count != archived:
+                    raise click.ClickException(f'{name} changed while it was being archived; try again.')
+                # Summary rows first, in the order saves take them, then the table
+                cur.execute(LOCK_SUMMARIES_SQL, (student_ids,))
+                cur.execute(f"ALTER TABLE student_responses DETACH PARTITION {name}")
+                cur.execute(f"DROP TABLE {name}")
+                cur.execute(REFRESH_SUMMARIES_SQL, (student_ids,))
+                os.replace(partial, path)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for leftover in (partial, path):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+                raise
+        finally:
+            cur.close()
+        bump_data_version(conn)
+    click.echo(f'Archived {archived} responses from the {term:%Y-%m} term to {path} and dropped {name}.')
+
+@bp.cli.command('restore-term')
+@click.argument('archive', type=click.Path(exists=True, dir_okay=False))
+def restore_term_command(archive):
+    """Load a file written by archive-term back in and re-attach it as its term's partition."""
+    match = RESPONSE_ARCHIVE_NAME.search(os.path.basename(archive))
+    if match is None:
+        raise click.BadParameter('expected a student_responses_YYYY_MM.csv.gz file from archive-term',
+                                 param_hint="'ARCHIVE'")
+    name = match.group(1)
+    term = datetime(int(match.group(2)), int(match.group(3)), 1).date()
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT to_regclass(%s)", (name,))
+            if cur.fetchone()[0] is not None:
+                raise click.ClickException(f'{name} already exists.')
+            # Load into a standalone table, so the parent is only locked for the attach.
+            # Answers pass through text: archives made before answers were JSONB hold raw text.
+            columns = ', '.join(RESPONSE_ARCHIVE_COLUMNS)
+            cur.execute(f"CREATE TEMP TABLE response_restore ON COMMIT DROP AS "
+                        f"SELECT {columns} FROM student_responses WITH NO DATA")
+            cur.execute("ALTER TABLE response_restore ALTER COLUMN student_answer TYPE text")
+            with gzip.open(archive, 'rb') as rows:
+                cur.copy_expert(f"COPY response_restore ({columns}) FROM STDIN WITH (FORMAT csv, HEADER)", rows)
+                restored = cur.rowcount
+            cur.execute(f"CREATE TABLE {name} (LIKE student_responses INCLUDING DEFAULTS INCLUDING GENERATED)")
+            # An answer saved again since the archive was made lives in a later term
+            # now, and that newer row wins
+            cur.execute(f"INSERT INTO {name} ({columns}) "
+                        f"SELECT {columns.replace('student_answer', 'answer_to_jsonb(student_answer)')} "
+                        "FROM response_restore r WHERE NOT EXISTS ("
+                        "    SELECT 1 FROM student_responses sr"
+                        "    WHERE sr.student_id = r.student_id AND sr.lesson_id = r.lesson_id"
+                        "      AND sr.question_type = r.question_type AND sr.question_id = r.question_id)")
+            superseded = restored - cur.rowcount
+            restored = cur.rowcount
+            cur.execute(f"SELECT COALESCE(array_agg(DISTINCT student_id), '{{}}') FROM {name}")
+            student_ids = cur.fetchone()[0]
+            cur.execute("SELECT set_config('lock_timeout', %s, true)", (PARTITION_LOCK_TIMEOUT,))
+            cur.execute(LOCK_SUMMARIES_SQL, (student_ids,))
+            cur.execute(f"ALTER TABLE student_responses ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                        (term, term_end(term)))
+            cur.execute(REFRESH_SUMMARIES_SQL, (student_ids,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        bump_data_version(conn)
+    click.echo(f'Restored {restored} responses for the {term:%Y-%m} term into {name}'
+               + (f' ({superseded} answered again since and skipped).' if superseded else '.'))
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    return sort_value, int(row_id)
+
+def build_roster_query(args):
+    """Translate roster query-string options into (sql, params, limit).
+
+    Raises ValueError for options that don't parse.
+    """
+    sort = args.get('sort', 'created_at')
+    if sort not in ROSTER_SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(ROSTER_SORT_KEYS)}")
+    order = args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    sort_expr, sort_type = ROSTER_SORT_KEYS[sort]
+
+    conditions, params = [], []
+    if args.get('class_name'):
+        conditions.append('s.class_name = %s')
+        params.append(args['class_name'])
+    if args.get('active_since'):
+        conditions.append('ps.last_activity >= %s')
+        params.append(datetime.fromisoformat(args['active_since']))
+    if args.get('q'):
+        pattern = '%' + args['q'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append('(s.student_name ILIKE %s OR s.email ILIKE %s)')
+        params.extend([pattern, pattern])
+    if args.get('cursor'):
+        sort_value, last_id = decode_cursor(args['cursor'])
+        comparison = '<' if order == 'desc' else '>'
+        conditions.append(f'({sort_expr}, s.id) {comparison} (%s::{sort_type}, %s)')
+        params.extend([sort_value, last_id])
+
+    limit = args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, ROSTER_MAX_PAGE_SIZE))
+
+    sql = f"""
+        SELECT s.id, s.email, s.student_name, s.student_id, s.class_name, s.created_at, s.last_login,
+               COALESCE(ps.lessons_started, 0) as lessons_started,
+               COALESCE(ps.total_responses, 0) as total_responses,
+               COALESCE(ps.correct_responses, 0) as correct_responses,
+               ps.last_activity,
+               {sort_expr} as sort_value
+        FROM students s
+        LEFT JOIN student_progress_summary ps ON s.id = ps.student_id
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY {sort_expr} {order}, s.id {order}
+    """
+    return sql, params, limit
+
+# Teacher dashboard - list students a page at a time (with authentication)
+#   ?limit=&cursor=            keyset pagination; pass back next_cursor for the next page
+#   ?class_name=&active_since=&q=   filters (q searches name and email)
+#   ?sort=created_at|student_name|email|last_login&order=asc|desc
+#   ?format=ndjson             stream every matching student, one JSON object per line
+@bp.route('/api/teacher/students', methods=['GET'])
+def get_all_students():
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        sql, params, limit = build_roster_query(request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+    with db_read_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+
+        try:
+            etag = make_etag('roster', read_data_version(conn), request.query_string)
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
+
+            if request.args.get('format') == 'ndjson':
+                # The stream borrows its own connection for as long as the client reads
+                stream = Response(stream_roster(sql, params, limit), mimetype='application/x-ndjson')
+                return tag_response(stream, etag)
+
+            limit = limit or ROSTER_PAGE_SIZE
+            # Fetch one extra row to learn whether another page follows
+            cur.execute(sql + " LIMIT %s", (*params, limit + 1))
+            students = [dict(s) for s in cur.fetchall()]
+            next_cursor = None
+            if len(students) > limit:
+                students = students[:limit]
+                next_cursor = encode_cursor(students[-1]['sort_value'], students[-1]['id'])
+            for student in students:
+                del student['sort_value']
+            return tag_response(jsonify({'students': students, 'next_cursor': next_cursor}), etag)
+
+        except Exception:
+            logger.exception('Loading the student roster failed')
+            return jsonify({'error': 'The student list could not be loaded'}), 500
+        finally:
+            cur.close()
+
+ROSTER_STREAM_FETCH_SIZE = 500
+
+def stream_roster(sql, params, limit):
+    """Yield roster rows as NDJSON through a server-side cursor, never holding the full list."""
+    if limit:
+        sql, params = sql + " LIMIT %s", (*params, limit)
+    with db_read_connection() as conn:
+        cur = conn.cursor(name='roster_export', cursor_factory=RealDictCursor)
+        cur.itersize = ROSTER_STREAM_FETCH_SIZE
+        try:
+            cur.execute(sql, params)
+            for student in cur:
+                student = dict(student)
+                del student['sort_value']
+                yield flask_json.dumps(student) + '\n'
+        finally:
+            cur.close()
+
+def with_lesson_info(responses):
+    """Attach lesson_title/lesson_slug from the catalog, ordered by lesson title."""
+    lessons = lesson_catalog.by_id
+    if any(r['lesson_id'] not in lessons for r in responses):
+        lesson_catalog.refresh()
+        lessons = lesson_catalog.by_id
+    annotated = []
+    for r in responses:
+        lesson = lessons.get(r['lesson_id'])
+        if lesson is not None:
+            r['lesson_title'] = lesson.title
+            r['lesson_slug'] = lesson.slug
+            annotated.append(r)
+    # Stable sort keeps the (question_type, question_id) order within each lesson
+    annotated.sort(key=lambda r: r['lesson_title'])
+    return annotated
+
+# Teacher dashboard - get student details (with authentication)
+@bp.route('/api/teacher/student/<int:student_id>/details', methods=['GET'])
+def get_student_details(student_id):
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    with db_read_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+
+        try:
+            # Version stamp: the profile row plus the student's response summary
+            cur.execute("""
+                SELECT md5(s::text) AS profile_hash, ps.total_responses, ps.last_activity
+                FROM students s
+                LEFT JOIN student_progress_summary ps ON ps.student_id = s.id
+                WHERE s.id = %s
+            """, (student_id,))
+            stamp = cur.fetchone()
+
+            if not stamp:
+                return jsonify({'error': 'Student not found'}), 404
 
-@login_manager.user_loader
-def load_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        cur.execute("SELECT * FROM students WHERE id = %s AND is_active = TRUE", (user_id,))
-        user_data = cur.fetchone()
-        if user_data:
-            return User(user_data['id'], user_data['email'], user_data['student_name'], 
-                       user_data['student_id'], user_data['class_name'], user_data['is_active'])
-    finally:
-        cur.close()
-        conn.close()
-    return None
+            etag = make_etag('details', student_id, *stamp.values())
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
 
-# Forms
-class RegistrationForm(FlaskForm):
-    email = StringField('Email', validators=[DataRequired(), Email()])
-    student_name = StringField('Full Name', validators=[DataRequired()])
-    student_id = StringField('Student ID (optional)')
-    class_name = StringField('Class/Grade (optional)')
-    password = PasswordField('Password', validators=[DataRequired()])
-    confirm_password = PasswordField('Confirm Password', 
-                                   validators=[DataRequired(), EqualTo('password')])
-    submit = SubmitField('Register')
+            # Get student info
+            cur.execute("""
+                SELECT id, email, student_name, student_id, class_name, is_active, created_at, last_login
+                FROM students WHERE id = %s
+            """, (student_id,))
+            student = cur.fetchone()
 
-class LoginForm(FlaskForm):
-    email = StringField('Email', validators=[DataRequired(), Email()])
-    password = PasswordField('Password', validators=[DataRequired()])
-    submit = SubmitField('Log In')
+            if not student:
+                return jsonify({'error': 'Student not found'}), 404
 
-# Database connection
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('PGHOST'),
-        database=os.getenv('PGDATABASE'), 
-        user=os.getenv('PGUSER'),
-        password=os.getenv('PGPASSWORD'),
-        port=os.getenv('PGPORT')
-    )
+            # Get all responses with last activity; lesson info comes from the catalog
+            cur.execute(f"""
+                SELECT {RESPONSE_FIELDS_SQL},
+                       (SELECT MAX(updated_at) FROM student_responses WHERE student_id = %s) as last_activity
+                FROM student_responses sr
+                WHERE sr.student_id = %s
+                ORDER BY sr.question_type, sr.question_id
+            """, (student_id, student_id))
 
-# Registration page
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    form = RegistrationForm()
-    if form.validate_on_submit():
-        conn = get_db_connection()
-        cur = conn.cursor()
+            responses = [dict(r) for r in cur.fetchall()]
+
+            return tag_response(jsonify({
+                'student': dict(student),
+                'responses': with_lesson_info(responses)
+            }), etag)
+
+        except Exception:
+            logger.exception('Loading details for student %s failed', student_id)
+            return jsonify({'error': 'The student details could not be loaded'}), 500
+        finally:
+            cur.close()
+
+# Teacher dashboard - live events as Server-Sent Events (with authentication)
+@bp.route('/api/teacher/stream', methods=['GET'])
+def teacher_event_stream():
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+
+    events = teacher_events.subscribe()
+    # Each open stream holds a server thread, so streams end after max_age (the
+    # dashboard reconnects and reloads the roster) or when the worker shuts down
+    deadline = time.monotonic() + teacher_events.max_age
+
+    def generate():
         try:
-            # Check if email already exists
-            cur.execute("SELECT id FROM students WHERE email = %s", (form.email.data,))
-            if cur.fetchone():
-                flash('Email already registered. Please log in instead.', 'error')
-                return redirect(url_for('login'))
-            
-            # Create new user
-            password_hash = generate_password_hash(form.password.data)
-            cur.execute("""
-                INSERT INTO students (email, student_name, student_id, class_name, password_hash)
-                VALUES (%s, %s, %s, %s, %s) RETURNING id
-            """, (form.email.data, form.student_name.data, form.student_id.data or '', 
-                  form.class_name.data or '', password_hash))
-            
-            user_id = cur.fetchone()[0]
+            yield 'retry: 3000\n\n'
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    payload = events.get(timeout=min(SSE_HEARTBEAT_INTERVAL, remaining))
+                except queue.Empty:
+                    if time.monotonic() < deadline:
+                        yield ': keep-alive\n\n'
+                    continue
+                if payload is None:
+                    return
+                event_type = json.loads(payload).get('type', 'message')
+                yield f'event: {event_type}\ndata: {payload}\n\n'
+        finally:
+            teacher_events.unsubscribe(events)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Teacher dashboard - update a student's profile or deactivate them (with authentication)
+STUDENT_EDITABLE_FIELDS = ('student_name', 'student_id', 'class_name', 'is_active')
+
+@bp.route('/api/teacher/student/<int:student_id>', methods=['PATCH'])
+def update_student(student_id):
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    data = request.get_json(silent=True) or {}
+    changes = {field: data[field] for field in STUDENT_EDITABLE_FIELDS if field in data}
+    if not changes:
+        return jsonify({'error': 'No editable fields provided'}), 400
+
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+
+        try:
+            assignments = ', '.join(f'{field} = %s' for field in changes)
+            cur.execute(f"""
+                UPDATE students SET {assignments} WHERE id = %s
+                RETURNING id, email, student_name, student_id, class_name, is_active
+            """, (*changes.values(), student_id))
+            student = cur.fetchone()
+            if not student:
+                return jsonify({'error': 'Student not found'}), 404
+
+            # Cached identities must not outlive a deactivation or a rename, in any worker
+            publish_teacher_event(cur, 'student_updated', student_id=student['id'], student=student)
             conn.commit()
-            
-            # Log the user in
-            user = User(user_id, form.email.data, form.student_name.data, 
-                       form.student_id.data or '', form.class_name.data or '')
-            login_user(user)
-            
-            flash('Registration successful! Welcome to the Programming Fundamentals course.', 'success')
-            return redirect(url_for('index'))
-            
-        except Exception as e:
+            bump_data_version(conn)
+            note_write()
+            invalidate_user(student_id)
+            return jsonify({'student': dict(student)})
+
+        except Exception:
             conn.rollback()
-            flash('Registration failed. Please try again.', 'error')
+            logger.exception('Updating student %s failed', student_id)
+            return jsonify({'error': 'The student could not be updated'}), 500
         finally:
             cur.close()
-            conn.close()
-    
-    return render_template_string(REGISTER_TEMPLATE, form=form)
 
-# Login page
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    form = LoginForm()
-    if form.validate_on_submit():
-        conn = get_db_connection()
+# Teacher dashboard - reload the lesson catalog after lessons are added or renamed
+@bp.route('/api/teacher/lessons/refresh', methods=['POST'])
+def refresh_lessons():
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        return jsonify({'success': True, 'lessons': lesson_catalog.refresh()})
+    except Exception:
+        logger.exception('Reloading the lesson catalog failed')
+        return jsonify({'error': 'The lessons could not be reloaded'}), 500
+
+# Class analytics: the student x question correctness matrix for one class and
+# lesson. Results are cached per (class, lesson) alongside a stamp of the class's
+# progress summaries; any save by a student in the class moves that stamp (in
+# whichever process or server mode handled it), so the next read recomputes.
+class StampedCache:
+    """Bounded LRU of computed results, each valid only while its stamp is unchanged."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (stamp, result)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1]
+
+    def put(self, key, stamp, result):
+        with self._lock:
+            self._entries[key] = (stamp, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, size=len(self._entries), max_size=self.maxsize)
+
+class_matrices = StampedCache(maxsize=Config.CLASS_MATRIX_CACHE_SIZE)
+
+CLASS_STUDENTS_SQL = """
+    SELECT s.id, s.student_name, s.student_id, ps.total_responses, ps.last_activity
+    FROM students s
+    LEFT JOIN student_progress_summary ps ON ps.student_id = s.id
+    WHERE s.class_name = %s AND s.is_active = TRUE
+    ORDER BY lower(s.student_name), s.id
+"""
+
+# One row per question: counts plus every answering student's is_correct, in step
+CLASS_MATRIX_SQL = """
+    SELECT sr.question_type, sr.question_id,
+           COUNT(*) AS answered,
+           COUNT(sr.is_correct) AS graded,
+           COUNT(*) FILTER (WHERE sr.is_correct) AS correct,
+           array_agg(sr.student_id) AS student_ids,
+           array_agg(sr.is_correct) AS results
+    FROM student_responses sr
+    JOIN students s ON s.id = sr.student_id
+    WHERE s.class_name = %s AND s.is_active = TRUE AND sr.lesson_id = %s
+    GROUP BY sr.question_type, sr.question_id
+    ORDER BY sr.question_type, sr.question_id
+"""
+
+def build_class_matrix(cur, class_name, lesson, students):
+    """Run the aggregate and shape it as per-question rates plus one row of results per student."""
+    cur.execute(CLASS_MATRIX_SQL, (class_name, lesson.id))
+    questions, rows = [], {student['id']: [] for student in students}
+    for question in cur.fetchall():
+        answers = dict(zip(question['student_ids'], question['results']))
+        questions.append({
+            'question_type': question['question_type'],
+            'question_id': question['question_id'],
+            'answered': question['answered'],
+            'correct': question['correct'],
+            'success_rate': (round(question['correct'] / question['graded'], 3)
+                             if question['graded'] else None),
+        })
+        for student_id, results in rows.items():
+            # None: not answered, or an answer that isn't marked right or wrong
+            results.append(answers.get(student_id))
+    return {
+        'class_name': class_name,
+        'lesson_slug': lesson.slug,
+        'lesson_title': lesson.title,
+        'questions': questions,
+        'students': [{'id': student['id'], 'student_name': student['student_name'],
+                      'student_id': student['student_id'], 'results': rows[student['id']]}
+                     for student in students],
+    }
+
+# Teacher dashboard - which questions a class gets right, student by student (with authentication)
+@bp.route('/api/teacher/class/<class_name>/lesson/<lesson_slug>/matrix', methods=['GET'])
+def get_class_matrix(class_name, lesson_slug):
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    lesson = lesson_catalog.get(lesson_slug)
+    if not lesson:
+        return jsonify({'error': 'Lesson not found'}), 404
+
+    with db_read_connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
+
         try:
-            cur.execute("SELECT * FROM students WHERE email = %s AND is_active = TRUE", 
-                       (form.email.data,))
-            user_data = cur.fetchone()
-            
-            if user_data and check_password_hash(user_data['password_hash'], form.password.data):
-                # Update last login
-                cur.execute("UPDATE students SET last_login = CURRENT_TIMESTAMP WHERE id = %s", 
-                           (user_data['id'],))
-                conn.commit()
-                
-                user = User(user_data['id'], user_data['email'], user_data['student_name'],
-                           user_data['student_id'], user_data['class_name'])
-                login_user(user)
-                
-                flash(f'Welcome back, {user.student_name}!', 'success')
-                return redirect(url_for('index'))
-            else:
-                flash('Invalid email or password.', 'error')
-                
-        except Exception as e:
-            flash('Login failed. Please try again.', 'error')
+            # Version stamp: the class's membership and each student's summary
+            cur.execute(CLASS_STUDENTS_SQL, (class_name,))
+            students = cur.fetchall()
+            if not students:
+                return jsonify({'error': 'Class not found'}), 404
+
+            stamp = make_etag(*(tuple(student.values()) for student in students))
+            etag = make_etag('matrix', class_name, lesson.id, stamp)
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
+
+            key = (class_name, lesson.id)
+            matrix = class_matrices.get(key, stamp)
+            if matrix is None:
+                matrix = build_class_matrix(cur, class_name, lesson, students)
+                class_matrices.put(key, stamp, matrix)
+            return tag_response(jsonify(matrix), etag)
+
+        except Exception:
+            logger.exception('Building the %s matrix for class %s failed', lesson_slug, class_name)
+            return jsonify({'error': 'The class matrix could not be loaded'}), 500
         finally:
             cur.close()
-            conn.close()
-    
-    return render_template_string(LOGIN_TEMPLATE, form=form)
 
-# Logout
-@app.route('/logout')
-@login_required
-def logout():
-    logout_user()
-    flash('You have been logged out.', 'info')
-    return redirect(url_for('login'))
+# Teacher dashboard - search a class's answers (with authentication)
+#   ?q=                 words to find (web search syntax: "quoted phrase", or, -not), ranked by relevance
+#   ?path=              a JSON path the answer must match, e.g. $[*] ? (@ like_regex "ada" flag "i")
+#   ?lesson_slug=&question_type=   filters
+#   ?limit=&cursor=     pages, newest first within equal rank; pass back next_cursor for the next page
+SEARCH_PAGE_SIZE = 25
+SEARCH_MAX_PAGE_SIZE = 100
 
-# Serve specific HTML files - now with authentication
-@app.route('/')
-def index():
-    if current_user.is_authenticated:
-        return send_from_directory('.', 'index.html')
-    else:
-        return redirect(url_for('login'))
+def build_response_search(class_name, args):
+    """Translate search options into (sql, params, limit); raises ValueError for options that don't parse."""
+    q = (args.get('q') or '').strip()
+    path = (args.get('path') or '').strip()
+    if not q and not path:
+        raise ValueError('pass q (words to search for), path (a JSON path) or both')
 
-@app.route('/index.html')
-@login_required
-def index_html():
-    return send_from_directory('.', 'index.html')
+    rank_sql, rank_params = '0::real', []
+    conditions, params = ['s.class_name = %s', 's.is_active = TRUE'], [class_name]
+    if q:
+        rank_sql, rank_params = "ts_rank(sr.answer_search, websearch_to_tsquery('english', %s))", [q]
+        conditions.append("sr.answer_search @@ websearch_to_tsquery('english', %s)")
+        params.append(q)
+    if path:
+        conditions.append('sr.student_answer @? %s::jsonpath')
+        params.append(path)
+    if args.get('lesson_slug'):
+        lesson = lesson_catalog.get(args['lesson_slug'])
+        if lesson is None:
+            raise ValueError(f"unknown lesson {args['lesson_slug']!r}")
+        conditions.append('sr.lesson_id = %s')
+        params.append(lesson.id)
+    if args.get('question_type'):
+        conditions.append('sr.question_type = %s')
+        params.append(args['question_type'])
 
-@app.route('/Coding.html')
-@login_required
-def coding_html():
-    return send_from_directory('.', 'Coding.html')
+    page_condition, page_params = '', []
+    if args.get('cursor'):
+        rank, last_id = decode_cursor(args['cursor'])
+        page_condition, page_params = 'WHERE (hits.rank, hits.id) < (%s::real, %s)', [float(rank), last_id]
 
-@app.route('/Coding_al.html')
-@login_required
-def coding_al_html():
-    return send_from_directory('.', 'Coding_al.html')
+    limit = args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
 
-@app.route('/teacher.html')
-def teacher_html():
-    return send_from_directory('.', 'teacher.html')
+    sql = f"""
+        SELECT * FROM (
+            SELECT sr.id, s.id AS student_db_id, s.student_name, s.student_id, l.lesson_slug, l.lesson_title,
+                   sr.question_type, sr.question_id, sr.student_answer, sr.is_correct, sr.updated_at,
+                   {rank_sql} AS rank
+            FROM student_responses sr
+            JOIN students s ON s.id = sr.student_id
+            JOIN lessons l ON l.id = sr.lesson_id
+            WHERE {' AND '.join(conditions)}
+        ) hits
+        {page_condition}
+        ORDER BY hits.rank DESC, hits.id DESC
+        LIMIT %s
+    """
+    # One extra row tells whether another page follows
+    return sql, [*rank_params, *params, *page_params, limit + 1], limit
 
-# API Health Check endpoint
-@app.route('/api', methods=['GET', 'HEAD'])
-def api_health():
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'service': 'Programming Fundamentals Educational Platform'
-    })
+@bp.route('/api/teacher/class/<class_name>/search', methods=['GET'])
+def search_class_responses(class_name):
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        sql, params, limit = build_response_search(class_name, request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
 
-# Get current user info for JavaScript
-@app.route('/api/user/current', methods=['GET'])
-@login_required
-def get_current_user():
-    return jsonify({
-        'id': current_user.id,
-        'email': current_user.email,
-        'student_name': current_user.student_name,
-        'student_id': current_user.student_id,
-        'class_name': current_user.class_name
-    })
+    with db_read_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
 
-# Save student response (now using authenticated user)
-@app.route('/api/response/save', methods=['POST'])
-@login_required
-def save_response():
-    data = request.json
-    lesson_slug = data.get('lesson_slug')
-    question_type = data.get('question_type')
-    question_id = data.get('question_id')
-    student_answer = data.get('student_answer')
-    is_correct = data.get('is_correct')
-    
-    if not all([lesson_slug, question_type, question_id]):
-        return jsonify({'error': 'Missing required fields'}), 400
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        # Get lesson ID
-        cur.execute("SELECT id FROM lessons WHERE lesson_slug = %s", (lesson_slug,))
-        lesson = cur.fetchone()
-        if not lesson:
-            return jsonify({'error': 'Lesson not found'}), 404
-        
-        lesson_id = lesson[0]
-        
-        # Use UPSERT with authenticated user
-        cur.execute("""
-            INSERT INTO student_responses (student_id, lesson_id, question_type, question_id, student_answer, is_correct)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (student_id, lesson_id, question_type, question_id)
-            DO UPDATE SET 
-                student_answer = EXCLUDED.student_answer,
-                is_correct = EXCLUDED.is_correct,
-                updated_at = CURRENT_TIMESTAMP
-        """, (current_user.id, lesson_id, question_type, question_id,
-              json.dumps(student_answer) if isinstance(student_answer, (dict, list)) else student_answer,
-              is_correct))
-        
-        conn.commit()
-        return jsonify({'success': True})
-    
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'error': str(e)}), 500
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            if request.args.get('path'):
+                try:
+                    cur.execute("SELECT %s::jsonpath", (request.args['path'],))
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    return jsonify({'error': f'Invalid query: path: {e.diag.message_primary}'}), 400
 
-# Get student progress for a lesson (now using authenticated user)
-@app.route('/api/student/lesson/<lesson_slug>/progress', methods=['GET'])
-@login_required
-def get_student_progress(lesson_slug):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    try:
-        cur.execute("""
-            SELECT sr.* FROM student_responses sr
-            JOIN lessons l ON sr.lesson_id = l.id
-            WHERE sr.student_id = %s AND l.lesson_slug = %s
-            ORDER BY sr.updated_at DESC
-        """, (current_user.id, lesson_slug))
-        
-        responses = cur.fetchall()
-        return jsonify({'responses': [dict(r) for r in responses]})
-    
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        cur.close()
-        conn.close()
+            cur.execute(sql, params)
+            hits = cur.fetchall()
+            next_cursor = None
+            if len(hits) > limit:
+                hits = hits[:limit]
+                next_cursor = encode_cursor(hits[-1]['rank'], hits[-1]['id'])
+            results = [{
+                'id': hit['id'],
+                'student': {'id': hit['student_db_id'], 'student_name': hit['student_name'],
+                            'student_id': hit['student_id']},
+                'lesson_slug': hit['lesson_slug'],
+                'lesson_title': hit['lesson_title'],
+                'question_type': hit['question_type'],
+                'question_id': hit['question_id'],
+                'student_answer': hit['student_answer'],
+                'is_correct': hit['is_correct'],
+                'updated_at': hit['updated_at'],
+                'rank': hit['rank'],
+            } for hit in hits]
+            return jsonify({'results': results, 'next_cursor': next_cursor})
 
-# Simple teacher authentication (in production, use proper session-based auth)
-def require_teacher_auth():
-    auth = request.authorization
-    if not auth or not (auth.username == 'teacher' and auth.password == 'education123'):
-        return False
-    return True
+        except Exception:
+            logger.exception('Searching answers in class %s failed', class_name)
+            return jsonify({'error': 'The search could not be completed'}), 500
+        finally:
+            cur.close()
 
-# Teacher dashboard - get all students (with authentication)
-@app.route('/api/teacher/students', methods=['GET'])
-def get_all_students():
+# Class progress reports: one PDF per student, rendered on a process pool (PDF
+# layout is CPU-bound Python) and streamed back as a single zip as they finish.
+# Rendered reports are cached per student alongside a stamp of their profile and
+# latest answer, so only students with new work are rendered again.
+class ReportRenderer:
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, *args):
+        with self._lock:
+            # Created on first use so each forked worker gets its own processes. They
+            # are spawned rather than forked: forking a threaded server copies its locks.
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            executor = self._executor
+        return executor.submit(reports.render_report, *args)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+report_renderer = ReportRenderer(workers=Config.REPORT_WORKERS)
+report_cache = StampedCache(maxsize=Config.REPORT_CACHE_SIZE)
+
+CLASS_REPORT_STUDENTS_SQL = """
+    SELECT id, email, student_name, student_id, class_name
+    FROM students
+    WHERE class_name = %s AND is_active = TRUE
+    ORDER BY lower(student_name), id
+"""
+
+CLASS_REPORT_RESPONSES_SQL = f"""
+    SELECT {RESPONSE_FIELDS_SQL}
+    FROM student_responses sr
+    JOIN students s ON s.id = sr.student_id
+    WHERE s.class_name = %s AND s.is_active = TRUE
+    ORDER BY sr.student_id, sr.question_type, sr.question_id
+"""
+
+class ZipStream:
+    """Write-only file for zipfile that hands back what was written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+def report_filename(student):
+    name = re.sub(r'[^A-Za-z0-9]+', '_', student['student_name']).strip('_') or 'student'
+    return f"{name}_{student['id']}.pdf"
+
+def stream_class_reports(jobs):
+    """Yield a zip of every student's report: cached ones first, the rest as they finish rendering.
+
+    ``jobs`` holds (student, lessons, as_of, stamp) per student.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        pending = {}
+        try:
+            for student, lessons, as_of, stamp in jobs:
+                pdf = report_cache.get(student['id'], stamp)
+                if pdf is None:
+                    pending[report_renderer.submit(student, lessons, as_of)] = (student, stamp)
+                else:
+                    archive.writestr(report_filename(student), pdf)
+                    yield stream.drain()
+            for future in as_completed(pending):
+                student, stamp = pending[future]
+                pdf = future.result()
+                report_cache.put(student['id'], stamp, pdf)
+                archive.writestr(report_filename(student), pdf)
+                yield stream.drain()
+        finally:
+            # A client that went away doesn't need the rest rendered
+            for future in pending:
+                future.cancel()
+    yield stream.drain()
+
+# Teacher dashboard - a zip of PDF progress reports for a whole class (with authentication)
+@bp.route('/api/teacher/class/<class_name>/reports', methods=['GET'])
+def get_class_reports(class_name):
     if not require_teacher_auth():
         return jsonify({'error': 'Authentication required'}), 401
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
+    if reports is None:
+        return jsonify({'error': 'PDF reports are not installed on this server (pip install .[reports])'}), 501
+
+    with db_read_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+
+        try:
+            cur.execute(CLASS_REPORT_STUDENTS_SQL, (class_name,))
+            students = [dict(student) for student in cur.fetchall()]
+            if not students:
+                return jsonify({'error': 'Class not found'}), 404
+            # Every answer in the class in one query, in the shape the details API returns
+            cur.execute(CLASS_REPORT_RESPONSES_SQL, (class_name,))
+            responses = {}
+            for response in cur.fetchall():
+                responses.setdefault(response['student_id'], []).append(dict(response))
+        except Exception:
+            logger.exception('Loading report data for class %s failed', class_name)
+            return jsonify({'error': 'The reports could not be prepared'}), 500
+        finally:
+            cur.close()
+
+    jobs = []
+    for student in students:
+        answers = with_lesson_info(responses.get(student['id'], []))
+        lessons = {}
+        for answer in answers:
+            lessons.setdefault(answer['lesson_title'], []).append(answer)
+        as_of = max((answer['updated_at'] for answer in answers), default=None)
+        stamp = (tuple(student.values()), as_of, len(answers))
+        jobs.append((student, list(lessons.items()), as_of, stamp))
+
+    response = Response(stream_class_reports(jobs), mimetype='application/zip')
+    filename = re.sub(r'[^A-Za-z0-9]+', '_', class_name).strip('_') or 'class'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}_progress_reports.zip"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Bulk export of student responses (CSV or NDJSON), streamed through a server-side
+# cursor so memory stays flat however many rows match
+EXPORT_COLUMNS = ('id', 'email', 'student_name', 'student_id', 'class_name', 'lesson_slug',
+                  'lesson_title', 'question_type', 'question_id', 'student_answer', 'is_correct',
+                  'created_at', 'updated_at')
+EXPORT_ANSWER_INDEX = EXPORT_COLUMNS.index('student_answer')
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_FETCH_SIZE = 2000
+
+def build_export_query(args):
+    """Translate export filters (class_name, lesson_slug, since, until) into (sql, params).
+
+    Raises ValueError for dates that don't parse.
+    """
+    conditions, params = [], []
+    if args.get('class_name'):
+        conditions.append('s.class_name = %s')
+        params.append(args['class_name'])
+    if args.get('lesson_slug'):
+        conditions.append('l.lesson_slug = %s')
+        params.append(args['lesson_slug'])
+    if args.get('since'):
+        conditions.append('sr.updated_at >= %s')
+        params.append(datetime.fromisoformat(args['since']))
+    if args.get('until'):
+        conditions.append('sr.updated_at < %s')
+        params.append(datetime.fromisoformat(args['until']))
+
+    sql = f"""
+        SELECT sr.id, s.email, s.student_name, s.student_id, s.class_name, l.lesson_slug,
+               l.lesson_title, sr.question_type, sr.question_id, sr.student_answer, sr.is_correct,
+               sr.created_at, sr.updated_at
+        FROM student_responses sr
+        JOIN students s ON s.id = sr.student_id
+        JOIN lessons l ON l.id = sr.lesson_id
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY sr.student_id, sr.updated_at, sr.id
+    """
+    return sql, params
+
+def export_responses(sql, params, fmt):
+    """Yield the export one chunk per fetched batch (the CSV header comes first)."""
+    with db_read_connection() as conn:
+        cur = conn.cursor(name='responses_export')
+        try:
+            cur.execute(sql, params)
+            out = io.StringIO()
+            writer = csv.writer(out)
+            if fmt == 'csv':
+                writer.writerow(EXPORT_COLUMNS)
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    row = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+                    if fmt == 'csv':
+                        answer = row[EXPORT_ANSWER_INDEX]
+                        if answer is not None and not isinstance(answer, str):
+                            row[EXPORT_ANSWER_INDEX] = json.dumps(answer)
+                        writer.writerow(row)
+                    else:
+                        out.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n')
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+            if out.tell():
+                yield out.getvalue()
+        finally:
+            cur.close()
+
+# Teacher dashboard - export every matching response (with authentication)
+#   ?format=csv|ndjson   &class_name=&lesson_slug=&since=&until= (ISO dates; until is exclusive)
+@bp.route('/api/teacher/export/responses', methods=['GET'])
+def export_student_responses():
+    if not require_teacher_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
     try:
-        cur.execute("""
-            SELECT s.id, s.email, s.student_name, s.student_id, s.class_name, s.created_at, s.last_login,
-                   COUNT(DISTINCT sr.lesson_id) as lessons_started,
-                   COUNT(sr.id) as total_responses
-            FROM students s
-            LEFT JOIN student_responses sr ON s.id = sr.student_id
-            GROUP BY s.id, s.email, s.student_name, s.student_id, s.class_name, s.created_at, s.last_login
-            ORDER BY s.created_at DESC
-        """)
-        
-        students = cur.fetchall()
-        return jsonify({'students': [dict(s) for s in students]})
-    
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        cur.close()
-        conn.close()
+        sql, params = build_export_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
 
-# Teacher dashboard - get student details (with authentication)
-@app.route('/api/teacher/student/<int:student_id>/details', methods=['GET'])
-def get_student_details(student_id):
+    # The stream borrows its own connection for as long as the client reads
+    response = Response(export_responses(sql, params, fmt), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="student-responses-{datetime.now():%Y%m%d}.{fmt}"')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.cli.command('export-responses')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--class-name', help='Only students in this class.')
+@click.option('--lesson', 'lesson_slug', help='Only this lesson (by slug).')
+@click.option('--since', help='Only answers updated at or after this ISO date/time.')
+@click.option('--until', help='Only answers updated before this ISO date/time.')
+@click.option('--output', type=click.File('w', encoding='utf-8', lazy=False), default='-',
+              help='File to write (default: standard output).')
+def export_responses_command(fmt, class_name, lesson_slug, since, until, output):
+    """Export student responses as CSV or NDJSON."""
+    try:
+        sql, params = build_export_query({'class_name': class_name, 'lesson_slug': lesson_slug,
+                                          'since': since, 'until': until})
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--since' / '--until'")
+    for chunk in export_responses(sql, params, fmt):
+        output.write(chunk)
+
+# Bulk roster import: validate a CSV of students, hash the initial passwords in
+# parallel, COPY the rows into a temporary staging table and create the accounts
+# with one INSERT ... SELECT that skips (and reports) emails already registered
+ROSTER_IMPORT_COLUMNS = ('email', 'student_name', 'student_id', 'class_name', 'password')
+ROSTER_IMPORT_MAX_ROWS = 5000
+
+ROSTER_STAGING_DDL = """
+    CREATE TEMP TABLE roster_import (
+        line_no INTEGER NOT NULL,
+        email TEXT NOT NULL,
+        student_name TEXT NOT NULL,
+        student_id TEXT NOT NULL,
+        class_name TEXT NOT NULL,
+        password_hash TEXT NOT NULL
+    ) ON COMMIT DROP
+"""
+
+ROSTER_MERGE_SQL = """
+    WITH created AS (
+        INSERT INTO students (email, student_name, student_id, class_name, password_hash)
+        SELECT email, student_name, student_id, class_name, password_hash
+        FROM roster_import ORDER BY line_no
+        ON CONFLICT (email) DO NOTHING
+        RETURNING id, email
+    )
+    SELECT r.line_no, r.email, created.id
+    FROM roster_import r
+    LEFT JOIN created ON created.email = r.email
+    ORDER BY r.line_no
+"""
+
+def parse_roster_csv(text):
+    """Read roster rows from CSV text with a header line; returns (rows, errors).
+
+    Columns are email and student_name (required), and student_id, class_name
+    and password (optional; a blank password gets a generated one).
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    columns = [(name or '').strip().lower() for name in reader.fieldnames or []]
+    missing = [name for name in ('email', 'student_name') if name not in columns]
+    if missing:
+        return [], [{'line': 1, 'error': f"missing column(s): {', '.join(missing)}"}]
+    reader.fieldnames = columns
+
+    rows, errors, seen = [], [], {}
+    for record in reader:
+        line = reader.line_num
+        if len(rows) + len(errors) >= ROSTER_IMPORT_MAX_ROWS:
+            errors.append({'line': line, 'error': f'more than {ROSTER_IMPORT_MAX_ROWS} rows'})
+            break
+        row = {name: (record.get(name) or '').strip() for name in ROSTER_IMPORT_COLUMNS}
+        if not any(row.values()):
+            continue
+        if not row['student_name']:
+            errors.append({'line': line, 'error': 'student_name is required'})
+            continue
+        try:
+            validate_email(row['email'], check_deliverability=False)
+        except EmailNotValidError as e:
+            errors.append({'line': line, 'error': f"invalid email {row['email']!r}: {e}"})
+            continue
+        if row['email'] in seen:
+            errors.append({'line': line, 'error': f"{row['email']} already appears on line {seen[row['email']]}"})
+            continue
+        seen[row['email']] = line
+        row['line'] = line
+        rows.append(row)
+    return rows, errors
+
+def import_roster(rows):
+    """Create accounts for validated roster rows; returns {'created': [...], 'duplicates': [...]}.
+
+    Created entries carry the generated initial_password for rows that had none.
+    """
+    generated = {}
+    for row in rows:
+        if not row['password']:
+            row['password'] = generated[row['line']] = secrets.token_urlsafe(9)
+    # Hash with no connection checked out, several at a time
+    hashes = password_hasher.hash_many([row['password'] for row in rows])
+
+    staging = io.StringIO()
+    writer = csv.writer(staging)
+    for row, password_hash in zip(rows, hashes):
+        writer.writerow((row['line'], row['email'], row['student_name'], row['student_id'],
+                         row['class_name'], password_hash))
+    staging.seek(0)
+
+    created, duplicates = [], []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(ROSTER_STAGING_DDL)
+            # Unquoted empty fields would otherwise load as NULL rather than ''
+            cur.copy_expert("COPY roster_import FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (student_id, class_name))",
+                            staging)
+            cur.execute(ROSTER_MERGE_SQL)
+            for line, email, student_id in cur.fetchall():
+                if student_id is None:
+                    duplicates.append({'line': line, 'email': email})
+                else:
+                    entry = {'line': line, 'id': student_id, 'email': email}
+                    if line in generated:
+                        entry['initial_password'] = generated[line]
+                    created.append(entry)
+            if created:
+                publish_teacher_event(cur, 'students_imported', created=len(created))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        if created:
+            bump_data_version(conn)
+            note_write()
+    return {'created': created, 'duplicates': duplicates}
+
+# Teacher dashboard - create student accounts from a CSV roster (with authentication).
+# Send the CSV as the request body or as a "file" form upload; any invalid row
+# rejects the whole file, and emails that are already registered are skipped.
+@bp.route('/api/teacher/students/import', methods=['POST'])
+def import_students():
     if not require_teacher_auth():
         return jsonify({'error': 'Authentication required'}), 401
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
+    upload = request.files.get('file')
+    raw = upload.read() if upload else request.get_data()
     try:
-        # Get student info
-        cur.execute("SELECT * FROM students WHERE id = %s", (student_id,))
-        student = cur.fetchone()
-        
-        if not student:
-            return jsonify({'error': 'Student not found'}), 404
-        
-        # Get all responses with lesson info and last activity
-        cur.execute("""
-            SELECT sr.*, l.lesson_title, l.lesson_slug,
-                   (SELECT MAX(updated_at) FROM student_responses WHERE student_id = %s) as last_activity
-            FROM student_responses sr
-            JOIN lessons l ON sr.lesson_id = l.id
-            WHERE sr.student_id = %s
-            ORDER BY l.lesson_title, sr.question_type, sr.question_id
-        """, (student_id, student_id))
-        
-        responses = cur.fetchall()
-        
-        return jsonify({
-            'student': dict(student),
-            'responses': [dict(r) for r in responses]
-        })
-    
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        cur.close()
-        conn.close()
+        text = raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return jsonify({'error': 'The roster must be UTF-8 encoded CSV'}), 400
+
+    rows, errors = parse_roster_csv(text)
+    if errors:
+        return jsonify({'error': 'Invalid roster', 'errors': errors}), 400
+    if not rows:
+        return jsonify({'error': 'The roster has no students'}), 400
+    try:
+        return jsonify(import_roster(rows))
+    except Exception:
+        # COPY and merge errors can quote uploaded rows, so only the log gets them
+        logger.exception('Importing a roster of %s students failed', len(rows))
+        return jsonify({'error': 'The roster could not be imported'}), 500
+
+@bp.cli.command('import-students')
+@click.argument('roster', type=click.File('r', encoding='utf-8-sig'))
+def import_students_command(roster):
+    """Create student accounts from a CSV roster (email, student_name, student_id, class_name, password)."""
+    rows, errors = parse_roster_csv(roster.read())
+    for error in errors:
+        click.echo(f"Line {error['line']}: {error['error']}", err=True)
+    if errors:
+        raise click.ClickException('Nothing imported; fix the rows above and try again.')
+    result = import_roster(rows)
+    for duplicate in result['duplicates']:
+        click.echo(f"Line {duplicate['line']}: {duplicate['email']} is already registered, skipped", err=True)
+    for student in result['created']:
+        if 'initial_password' in student:
+            click.echo(f"{student['email']},{student['initial_password']}")
+    click.echo(f"Imported {len(result['created'])} student(s), skipped {len(result['duplicates'])} duplicate(s).",
+               err=True)
 
 # HTML Templates
 LOGIN_TEMPLATE = '''
@@ -360,87 +3650,7 @@ LOGIN_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Student Login - Programming Fundamentals</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            max-width: 500px;
-            margin: 50px auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }
-        .auth-container {
-            background: white;
-            padding: 40px;
-            border-radius: 10px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }
-        h1 {
-            color: #005A9C;
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        .form-group {
-            margin-bottom: 20px;
-        }
-        label {
-            display: block;
-            margin-bottom: 5px;
-            font-weight: bold;
-            color: #333;
-        }
-        input[type="email"], input[type="password"] {
-            width: 100%;
-            padding: 12px;
-            border: 1px solid #ddd;
-            border-radius: 5px;
-            font-size: 16px;
-            box-sizing: border-box;
-        }
-        .btn {
-            width: 100%;
-            padding: 12px;
-            background-color: #005A9C;
-            color: white;
-            border: none;
-            border-radius: 5px;
-            font-size: 16px;
-            cursor: pointer;
-        }
-        .btn:hover {
-            background-color: #004080;
-        }
-        .auth-link {
-            text-align: center;
-            margin-top: 20px;
-        }
-        .auth-link a {
-            color: #005A9C;
-            text-decoration: none;
-        }
-        .flash-messages {
-            margin-bottom: 20px;
-        }
-        .flash-message {
-            padding: 10px;
-            border-radius: 5px;
-            margin-bottom: 10px;
-        }
-        .flash-success {
-            background-color: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-        .flash-error {
-            background-color: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-        .flash-info {
-            background-color: #cce7ff;
-            color: #004085;
-            border: 1px solid #b3d7ff;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('main.auth_stylesheet') }}">
 </head>
 <body>
     <div class="auth-container">
@@ -473,7 +3683,7 @@ LOGIN_TEMPLATE = '''
         </form>
         
         <div class="auth-link">
-            <p>Don't have an account? <a href="{{ url_for('register') }}">Register here</a></p>
+            <p>Don't have an account? <a href="{{ url_for('main.register') }}">Register here</a></p>
         </div>
     </div>
 </body>
@@ -487,86 +3697,7 @@ REGISTER_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Student Registration - Programming Fundamentals</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            max-width: 500px;
-            margin: 50px auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }
-        .auth-container {
-            background: white;
-            padding: 40px;
-            border-radius: 10px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }
-        h1 {
-            color: #005A9C;
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        .form-group {
-            margin-bottom: 20px;
-        }
-        label {
-            display: block;
-            margin-bottom: 5px;
-            font-weight: bold;
-            color: #333;
-        }
-        input[type="email"], input[type="text"], input[type="password"] {
-            width: 100%;
-            padding: 12px;
-            border: 1px solid #ddd;
-            border-radius: 5px;
-            font-size: 16px;
-            box-sizing: border-box;
-        }
-        .btn {
-            width: 100%;
-            padding: 12px;
-            background-color: #005A9C;
-            color: white;
-            border: none;
-            border-radius: 5px;
-            font-size: 16px;
-            cursor: pointer;
-        }
-        .btn:hover {
-            background-color: #004080;
-        }
-        .auth-link {
-            text-align: center;
-            margin-top: 20px;
-        }
-        .auth-link a {
-            color: #005A9C;
-            text-decoration: none;
-        }
-        .flash-messages {
-            margin-bottom: 20px;
-        }
-        .flash-message {
-            padding: 10px;
-            border-radius: 5px;
-            margin-bottom: 10px;
-        }
-        .flash-success {
-            background-color: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-        .flash-error {
-            background-color: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-        .optional {
-            color: #666;
-            font-size: 14px;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('main.auth_stylesheet') }}">
 </head>
 <body>
     <div class="auth-container">
@@ -621,12 +3752,105 @@ REGISTER_TEMPLATE = '''
         </form>
         
         <div class="auth-link">
-            <p>Already have an account? <a href="{{ url_for('login') }}">Log in here</a></p>
+            <p>Already have an account? <a href="{{ url_for('main.login') }}">Log in here</a></p>
         </div>
     </div>
 </body>
 </html>
 '''
 
+AUTH_TEMPLATES = {'login': LOGIN_TEMPLATE, 'register': REGISTER_TEMPLATE}
+
+# Stands in for the CSRF token in a cached login/register shell
+CSRF_PLACEHOLDER = '\x00csrf-token\x00'
+
+def compile_auth_templates(app):
+    """Parse the login/register templates once per app instead of on every render."""
+    app.extensions['auth_templates'] = {name: app.jinja_env.from_string(source)
+                                        for name, source in AUTH_TEMPLATES.items()}
+    app.extensions['auth_shells'] = {}
+
+def render_auth_page(name, form):
+    """Render the login or register page from its compiled template.
+
+    A GET with no flashed messages produces the same page for everyone apart from
+    the CSRF token, so the first one is kept as a shell and later ones only splice
+    in the visitor's token.
+    """
+    shells = current_app.extensions['auth_shells']
+    plain_get = request.method == 'GET' and not session.get('_flashes')
+    if plain_get and name in shells:
+        return shells[name].replace(CSRF_PLACEHOLDER, generate_csrf() if form.meta.csrf else '')
+    html = render_template(current_app.extensions['auth_templates'][name], form=form)
+    if plain_get:
+        token = form.csrf_token.current_token if form.meta.csrf else None
+        shells[name] = html.replace(token, CSRF_PLACEHOLDER) if token else html
+    return html
+
+def configure_services(config):
+    """Apply app config to the process-wide pool settings, caches and buffers."""
+    _db_pool_settings.update(minconn=config['PG_POOL_MIN'], maxconn=config['PG_POOL_MAX'],
+                             idle_timeout=config['PG_POOL_IDLE_TIMEOUT'],
+                             checkout_timeout=config['PG_POOL_TIMEOUT'],
+                             health_check_after=config['PG_POOL_HEALTH_CHECK_AFTER'])
+    query_registry.prepare = config['PG_PREPARED_STATEMENTS']
+    user_cache.maxsize = config['USER_CACHE_SIZE']
+    user_cache.ttl = config['USER_CACHE_TTL']
+    lesson_catalog.max_age = config['LESSON_CATALOG_MAX_AGE']
+    class_matrices.maxsize = config['CLASS_MATRIX_CACHE_SIZE']
+    report_cache.maxsize = config['REPORT_CACHE_SIZE']
+    report_renderer.workers = config['REPORT_WORKERS']
+    _schema_settings['check'] = config['SCHEMA_CHECK']
+    _partition_settings.update(ahead=config['RESPONSE_PARTITIONS_AHEAD'], archive_dir=config['RESPONSE_ARCHIVE_DIR'])
+    read_replicas.dsns = list(config['PG_REPLICA_DSNS'])
+    read_replicas.retry_after = config['PG_REPLICA_RETRY_AFTER']
+    write_buffer.window = config['WRITE_BEHIND_WINDOW']
+    write_buffer.max_pending = config['WRITE_BEHIND_MAX_PENDING']
+    teacher_events.max_age = config['TEACHER_STREAM_MAX_AGE']
+    static_pages.max_age = config['STATIC_PAGE_MAX_AGE']
+    static_pages.reload = config['STATIC_PAGES_RELOAD']
+    password_hasher.workers = config['HASH_WORKERS']
+    password_hasher.queue_limit = config['HASH_QUEUE_LIMIT']
+    password_hasher.timeout = config['HASH_TIMEOUT']
+    ip_limiter.rate, ip_limiter.burst = config['LOGIN_IP_RATE'], config['LOGIN_IP_BURST']
+    email_limiter.rate, email_limiter.burst = config['LOGIN_EMAIL_RATE'], config['LOGIN_EMAIL_BURST']
+
+def warm_up():
+    """Open the pool, check the schema, create upcoming response partitions and load the lesson catalog and pages before the first request arrives."""
+    get_db_pool()
+    check_schema()
+    try:
+        ensure_response_partitions()
+    except psycopg2.Error as e:
+        # Rows for a missing term land in the default partition meanwhile
+        logger.warning("Could not create upcoming student_responses partitions: %s", e)
+    lesson_catalog.refresh()
+    static_pages.load()
+
+def shutdown_services():
+    """End live-update streams, write out buffered saves, stop the hashing threads and report processes and close pooled connections (graceful shutdown)."""
+    teacher_events.close()
+    write_buffer.close()
+    password_hasher.shutdown()
+    report_renderer.shutdown()
+    close_db_pool()
+
+def create_app(config=None):
+    """Build the Flask app; ``config`` is a mapping that overrides Config."""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if config:
+        app.config.from_mapping(config)
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    CORS(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    compile_auth_templates(app)
+    configure_services(app.config)
+    return app
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app = create_app()
+    check_schema()
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=app.config['DEBUG'])
\ No newline at end of file
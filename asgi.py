@@ -0,0 +1,305 @@
+# Async serving mode: uvicorn asgi:app (needs the "async" extra from pyproject.toml)
+#
+# The student API routes that only wait on Postgres (autosave, single and batched,
+# lesson progress and current user) run natively on asyncio with psycopg 3's async pool, so a waiting
+# request costs a coroutine instead of a thread. They keep the Flask app's URLs,
+# session cookie login and JSON shapes. Every other route, pages and teacher API
+# included, is the regular Flask app running on a thread pool.
+import asyncio
+import functools
+import logging
+import multiprocessing
+import signal
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+
+from a2wsgi import WSGIMiddleware
+from flask.sessions import SecureCookieSession
+from itsdangerous import BadSignature
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import RedirectResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+from app import (ACTIVE_STUDENT_SQL, BUMP_DATA_VERSION_SQL, LESSON_PROGRESS_SQL, LOAD_FAILED_MESSAGE,
+                 LOCK_SUMMARY_SQL, PUBLISH_EVENT_SQL, REFRESH_SUMMARY_SQL, SAVE_FAILED_MESSAGE,
+                 STUDENT_STAMP_SQL, UPSERT_RESPONSES_SQL, User, create_app, db_connect_kwargs,
+                 lesson_catalog, make_etag, overlay_pending_answers, parse_response_batch,
+                 read_replicas, response_item_error, response_row, saved_lesson_slugs,
+                 shutdown_services, teacher_event_params, teacher_events, user_cache,
+                 user_from_profile, warm_up, write_buffer)
+
+logger = logging.getLogger(__name__)
+
+flask_app = create_app()
+# uvicorn only runs the app in a child process under --workers N (or --reload), and
+# a save buffered in one worker would be invisible to progress reads in the others
+write_buffer.require_single_process(2 if multiprocessing.parent_process() else 1)
+
+db_pool = AsyncConnectionPool(
+    make_conninfo(**{('dbname' if key == 'database' else key): value
+                     for key, value in db_connect_kwargs().items() if value}),
+    min_size=flask_app.config['ASYNC_PG_POOL_MIN'], max_size=flask_app.config['ASYNC_PG_POOL_MAX'],
+    timeout=flask_app.config['PG_POOL_TIMEOUT'], max_idle=flask_app.config['PG_POOL_IDLE_TIMEOUT'],
+    # psycopg 3 prepares statements itself; have it do so on first use, like app.query_registry
+    kwargs={'prepare_threshold': 0 if flask_app.config['PG_PREPARED_STATEMENTS'] else None},
+    open=False)
+
+def json_response(data, status_code=200, headers=None):
+    # Same encoder as jsonify, so dates and key order match the Flask routes
+    body = flask_app.json.dumps(data, separators=(',', ':')) + '\n'
+    return Response(body, status_code, headers, media_type='application/json')
+
+def read_session(request):
+    """Decode Flask's signed session cookie; an invalid or expired one reads as empty."""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+def note_write(request, response):
+    """The async counterpart of app.note_write: stamp the session cookie with the save time.
+
+    Flask routes served by any worker then read this student's data from the
+    primary for READ_YOUR_WRITES_WINDOW seconds.
+    """
+    if not read_replicas.enabled:
+        return
+    interface = flask_app.session_interface
+    session = SecureCookieSession(read_session(request))
+    session['_last_write'] = time.time()
+    response.set_cookie(
+        interface.get_cookie_name(flask_app),
+        interface.get_signing_serializer(flask_app).dumps(dict(session)),
+        expires=interface.get_expiration_time(flask_app, session),
+        path=interface.get_cookie_path(flask_app), domain=interface.get_cookie_domain(flask_app),
+        secure=interface.get_cookie_secure(flask_app), httponly=interface.get_cookie_httponly(flask_app),
+        samesite=interface.get_cookie_samesite(flask_app))
+
+async def load_user(request):
+    """The async counterpart of app.load_user: cache, then session profile, then database."""
+    session = read_session(request)
+    if session.get('_user_id') is None:
+        return None
+    user_id = int(session['_user_id'])
+    user = user_cache.get(user_id)
+    if user is None and flask_app.config['USER_CACHE_FROM_SESSION']:
+        user = user_from_profile(session.get('_user_profile'), user_id)
+    if user is None:
+        async with db_pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(ACTIVE_STUDENT_SQL, (user_id,))
+                user_data = await cur.fetchone()
+        if user_data:
+            user = User(user_data['id'], user_data['email'], user_data['student_name'],
+                        user_data['student_id'], user_data['class_name'], user_data['is_active'])
+            user_cache.put(user)
+    return user
+
+def login_required(endpoint):
+    """Like flask_login.login_required: anonymous requests are sent to the login page."""
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        user = await load_user(request)
+        if user is None:
+            next_url = request.url.path + (f'?{request.url.query}' if request.url.query else '')
+            return RedirectResponse(f"/login?next={quote(next_url, safe='')}", status_code=302)
+        return await endpoint(request, user)
+    return wrapper
+
+async def fresh_lesson_catalog():
+    # The catalog reloads with psycopg2, so do that off the event loop
+    if lesson_catalog.stale:
+        await run_in_threadpool(lesson_catalog.refresh)
+    return lesson_catalog
+
+async def find_lesson(slug):
+    return (await fresh_lesson_catalog()).get(slug)
+
+async def write_responses(user_id, rows, lesson_slugs):
+    """Same steps as app.write_student_responses, then the commit and the data version bump."""
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rows))
+    async with db_pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(LOCK_SUMMARY_SQL, (user_id,))
+            await cur.execute(UPSERT_RESPONSES_SQL.format(values=values),
+                              [value for row in rows for value in (user_id, *row)])
+            await cur.execute(REFRESH_SUMMARY_SQL, (user_id, user_id))
+            summary = await cur.fetchone()
+            await cur.execute(PUBLISH_EVENT_SQL, teacher_event_params(
+                'response_saved', student_id=user_id, lesson_slugs=lesson_slugs,
+                saved=len(rows), summary=summary))
+        await conn.commit()
+        # nextval isn't transactional, so this runs after the commit like app.bump_data_version
+        await conn.execute(BUMP_DATA_VERSION_SQL)
+
+def cache_headers(etag, last_modified=None):
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': 'private, no-cache', 'Vary': 'Cookie'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def is_not_modified(request, etag, last_modified=None):
+    """The validator check from app.not_modified, against Starlette request headers."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains(etag)
+    if_modified_since = parse_date(request.headers.get('if-modified-since'))
+    return (last_modified is not None and if_modified_since is not None
+            and last_modified.replace(microsecond=0) <= if_modified_since.replace(tzinfo=None))
+
+@login_required
+async def get_current_user(request, user):
+    return json_response({
+        'id': user.id,
+        'email': user.email,
+        'student_name': user.student_name,
+        'student_id': user.student_id,
+        'class_name': user.class_name
+    })
+
+@login_required
+async def save_response(request, user):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return json_response({'error': 'Expected a JSON object'}, 400)
+    error = response_item_error(data)
+    if error:
+        return json_response({'error': error}, 400)
+
+    lesson = await find_lesson(data['lesson_slug'])
+    if not lesson:
+        return json_response({'error': 'Lesson not found'}, 404)
+
+    row = response_row(lesson, data)
+    if write_buffer.enabled:
+        write_buffer.add(user.id, [row])
+        response = json_response({'success': True, 'queued': True}, 202)
+        note_write(request, response)
+        return response
+
+    try:
+        await write_responses(user.id, [row], [lesson.slug])
+    except Exception:
+        logger.exception('Saving a response for student %s failed', user.id)
+        return json_response({'error': SAVE_FAILED_MESSAGE}, 500)
+    response = json_response({'success': True})
+    note_write(request, response)
+    return response
+
+@login_required
+async def save_response_batch(request, user):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    items = data.get('responses') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return json_response({'error': 'Expected a list of responses'}, 400)
+    max_batch_size = flask_app.config['MAX_BATCH_SIZE']
+    if len(items) > max_batch_size:
+        return json_response({'error': f'At most {max_batch_size} responses per batch'}, 413)
+
+    # Validation and saved_lesson_slugs read the catalog, which must not reload on the event loop
+    await fresh_lesson_catalog()
+    results, rows = parse_response_batch(items)
+
+    status = 200
+    if rows and write_buffer.enabled:
+        write_buffer.add(user.id, rows)
+        status = 202
+    elif rows:
+        try:
+            await write_responses(user.id, rows, saved_lesson_slugs(rows))
+        except Exception:
+            logger.exception('Saving %s responses for student %s failed', len(rows), user.id)
+            return json_response({'error': SAVE_FAILED_MESSAGE}, 500)
+
+    response = json_response({
+        'success': all(r['success'] for r in results),
+        'saved': sum(1 for r in results if r['success']),
+        'results': results
+    }, status)
+    if rows:
+        note_write(request, response)
+    return response
+
+@login_required
+async def get_student_progress(request, user):
+    lesson = await find_lesson(request.path_params['lesson_slug'])
+    if not lesson:
+        return json_response({'responses': []})
+
+    try:
+        async with db_pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(STUDENT_STAMP_SQL, (user.id,))
+                stamp = await cur.fetchone()
+                total_responses, last_activity = ((stamp['total_responses'], stamp['last_activity'])
+                                                  if stamp else (0, None))
+                buffered = write_buffer.stamp(user.id)
+                etag = make_etag('progress', user.id, lesson.id, total_responses, last_activity, buffered)
+                if buffered:
+                    # Buffered answers are newer than anything the database can date
+                    last_activity = None
+                if is_not_modified(request, etag, last_activity):
+                    return Response(status_code=304, headers=cache_headers(etag, last_activity))
+
+                await cur.execute(LESSON_PROGRESS_SQL, (user.id, lesson.id))
+                responses = overlay_pending_answers(await cur.fetchall(), user.id, lesson.id)
+        return json_response({'responses': responses}, headers=cache_headers(etag, last_activity))
+    except Exception:
+        logger.exception('Loading lesson progress for student %s failed', user.id)
+        return json_response({'error': LOAD_FAILED_MESSAGE}, 500)
+
+def end_streams_on_exit():
+    # uvicorn waits for open connections before the lifespan shutdown runs, and
+    # teacher live-update streams would hold it for TEACHER_STREAM_MAX_AGE; wrap its
+    # signal handlers so they end the streams first
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        handler = signal.getsignal(sig)
+        if not callable(handler):
+            continue
+
+        def end_streams(signum, frame, handler=handler):
+            loop.call_soon_threadsafe(teacher_events.close)
+            handler(signum, frame)
+
+        signal.signal(sig, end_streams)
+
+@asynccontextmanager
+async def lifespan(_):
+    # The Flask routes keep their psycopg2 pool; the async routes get their own
+    end_streams_on_exit()
+    await run_in_threadpool(warm_up)
+    await db_pool.open(wait=True)
+    yield
+    await db_pool.close()
+    await run_in_threadpool(shutdown_services)
+
+# Flask-CORS answers for the mounted app; the native routes get the same open policy
+cors = [Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+
+app = Starlette(routes=[
+    Route('/api/user/current', get_current_user, methods=['GET'], middleware=cors),
+    Route('/api/response/save', save_response, methods=['POST'], middleware=cors),
+    Route('/api/response/save_batch', save_response_batch, methods=['POST'], middleware=cors),
+    Route('/api/student/lesson/{lesson_slug}/progress', get_student_progress, methods=['GET'],
+          middleware=cors),
+    Mount('/', app=WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_WSGI_THREADS'])),
+], lifespan=lifespan)
@@ -0,0 +1,440 @@
+"""Load test for the student and teacher flows against a throwaway Postgres.
+
+Seeds students and responses into a fresh database, starts the app under
+gunicorn (or uvicorn for the async mode) and drives it through four phases:
+
+  login      every student loads the login page and signs in at once
+  autosave   students send answers through /api/response/save
+  progress   students reload lesson progress (first load, then revalidation)
+  teacher    teachers page through the roster and open student details
+
+Throughput and p50/p95/p99 latency per endpoint are printed and written as
+JSON, so runs before and after a change can be compared with --compare.
+
+    python benchmarks/load_test.py                      # initdb a temporary cluster
+    python benchmarks/load_test.py --use-server         # scratch database on the PG* server
+    python benchmarks/load_test.py --compare before.json --output after.json
+
+The load generator is a thread per concurrent client in this process, so very
+high request rates are bounded by the client as much as by the server; compare
+runs made on the same machine with the same options.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_PASSWORD = 'bench-password'
+TEACHER_AUTH = 'Basic ' + base64.b64encode(b'teacher:education123').decode()
+QUESTION_TYPES = ('quiz', 'code', 'timeline', 'match')
+CLASS_NAMES = ('7A', '7B', '8A', '8B', '9A')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def throwaway_cluster(bin_dir):
+    """initdb a temporary cluster listening on a private socket; removed afterwards."""
+    initdb = shutil.which('initdb', path=bin_dir)
+    pg_ctl = shutil.which('pg_ctl', path=bin_dir)
+    if not initdb or not pg_ctl:
+        sys.exit('initdb/pg_ctl not found; put the Postgres bin directory on PATH, '
+                 'pass --pg-bin, or use --use-server')
+    workdir = tempfile.mkdtemp(prefix='loadtest-pg-')
+    data_dir = os.path.join(workdir, 'data')
+    port = free_port()
+    try:
+        subprocess.run([initdb, '-D', data_dir, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8',
+                        '--no-sync'], check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, '-D', data_dir, '-w', '-l', os.path.join(workdir, 'postgres.log'),
+                        '-o', f"-p {port} -k {workdir} -c listen_addresses=''", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield {'PGHOST': workdir, 'PGPORT': str(port), 'PGUSER': 'postgres', 'PGPASSWORD': ''}
+        finally:
+            subprocess.run([pg_ctl, '-D', data_dir, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@contextmanager
+def scratch_database(server_env):
+    """A fresh database on the given server, dropped afterwards."""
+    import psycopg2
+    name = f'loadtest_{os.getpid()}'
+    admin_kwargs = dict(host=server_env.get('PGHOST'), port=server_env.get('PGPORT'),
+                        user=server_env.get('PGUSER'), password=server_env.get('PGPASSWORD') or None,
+                        dbname='postgres')
+    admin = psycopg2.connect(**admin_kwargs)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {name}')
+            cur.execute(f"CREATE DATABASE {name} ENCODING 'UTF8' TEMPLATE template0")
+        try:
+            yield dict(server_env, PGDATABASE=name)
+        finally:
+            with admin.cursor() as cur:
+                cur.execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+    finally:
+        admin.close()
+
+
+def seed(args):
+    """Migrate the scratch database and fill it; app is imported only now that PG* point at it."""
+    sys.path.insert(0, REPO_ROOT)
+    import app
+    from psycopg2.extras import execute_values
+    from werkzeug.security import generate_password_hash
+
+    app.run_migrations(echo=lambda message: None)
+    rng = random.Random(args.seed)
+    # One real hash shared by every student: the login storm still verifies it in full
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    with app.db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            execute_values(cur, """
+                INSERT INTO students (email, student_name, student_id, class_name, password_hash)
+                VALUES %s
+            """, [(f'student{i}@loadtest.example', f'Student {i:05d}', f'S{i:05d}',
+                   CLASS_NAMES[i % len(CLASS_NAMES)], password_hash) for i in range(args.students)],
+                page_size=1000)
+            cur.execute("SELECT id FROM students ORDER BY id")
+            student_ids = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT id FROM lessons ORDER BY id")
+            lesson_ids = [row[0] for row in cur.fetchall()]
+            rows = []
+            for student_id in student_ids:
+                keys = rng.sample([(lesson_id, question_type, f'{question_type}_{n}')
+                                   for lesson_id in lesson_ids for question_type in QUESTION_TYPES
+                                   for n in range(args.questions)],
+                                  min(args.responses, len(lesson_ids) * len(QUESTION_TYPES) * args.questions))
+                # student_answer is JSONB: seed answers the way the save API stores them
+                rows.extend((student_id, lesson_id, question_type, question_id,
+                             app.serialize_answer(f'answer {rng.random():.6f}'), rng.random() < 0.6)
+                            for lesson_id, question_type, question_id in keys)
+            execute_values(cur, """
+                INSERT INTO student_responses (student_id, lesson_id, question_type, question_id,
+                                               student_answer, is_correct)
+                VALUES %s
+            """, rows, page_size=5000)
+            cur.execute("TRUNCATE student_progress_summary")
+            cur.execute(app.SUMMARY_BACKFILL_SQL)
+            conn.commit()
+            cur.execute("ANALYZE")
+            conn.commit()
+        finally:
+            cur.close()
+    app.close_db_pool()
+    return student_ids, len(rows)
+
+
+@contextmanager
+def app_server(args, db_env):
+    port = free_port()
+    env = dict(os.environ, **db_env, PORT=str(port), WEB_CONCURRENCY=str(args.workers),
+               SECRET_KEY='loadtest', GUNICORN_ACCESS_LOG='/dev/null',
+               # Every simulated student shares 127.0.0.1, unlike a real class behind a few NATs
+               LOGIN_IP_BURST=str(args.students * 4), LOGIN_EMAIL_BURST='100')
+    if args.server == 'uvicorn':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port),
+                   '--workers', str(args.workers), '--no-access-log', '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, start_new_session=True)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+                conn.request('GET', '/api')
+                if conn.getresponse().status == 200:
+                    break
+            except OSError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                sys.exit('The app server did not start')
+            time.sleep(0.2)
+        yield port
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+class Recorder:
+    """Latencies and failures per endpoint label for one phase."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, label, seconds, ok, status=None):
+        with self._lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            if not ok:
+                # Failures by status code; "none" is a dropped connection or timeout
+                errors = self.errors.setdefault(label, {})
+                errors[str(status or 'none')] = errors.get(str(status or 'none'), 0) + 1
+
+
+class Client:
+    """One browser: a keep-alive connection plus its session cookie."""
+
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+        self.cookies = {}
+        self._connect()
+
+    def _connect(self):
+        self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        self.reused = False
+
+    def request(self, label, method, path, body=None, headers=None, expect=(200,)):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        while True:
+            started = time.perf_counter()
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                retry = self.reused
+                self.conn.close()
+                self._connect()
+                # Like a browser, retry once when the server had closed an idle keep-alive connection
+                if not retry:
+                    self.recorder.record(label, time.perf_counter() - started, False)
+                    return None, {}, b''
+        self.reused = True
+        self.recorder.record(label, time.perf_counter() - started, response.status in expect, response.status)
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, value = header.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value
+        return response.status, response.headers, data
+
+    def login(self, email):
+        _, _, page = self.request('GET /login', 'GET', '/login')
+        match = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        form = {'email': email, 'password': BENCH_PASSWORD, 'csrf_token': match.group(1).decode() if match else ''}
+        status, _, _ = self.request('POST /login', 'POST', '/login', body=urlencode(form),
+                                    headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                    expect=(302,))
+        return status == 302
+
+
+def run_phase(name, concurrency, jobs):
+    """Run ``jobs`` (callables taking a Recorder) on ``concurrency`` threads; returns the phase report."""
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(job, recorder) for job in jobs]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    endpoints = {}
+    for label, latencies in sorted(recorder.latencies.items()):
+        ordered = sorted(latencies)
+
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))] * 1000, 2)
+        endpoints[label] = {
+            'requests': len(ordered),
+            'errors': sum(recorder.errors.get(label, {}).values()),
+            'errors_by_status': recorder.errors.get(label, {}),
+            'throughput_rps': round(len(ordered) / elapsed, 1),
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+            'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99),
+            'max_ms': round(ordered[-1] * 1000, 2),
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return {'phase': name, 'duration_s': round(elapsed, 3), 'requests': total,
+            'throughput_rps': round(total / elapsed, 1), 'endpoints': endpoints}
+
+
+def drive(args, port, student_ids):
+    rng = random.Random(args.seed)
+    users = rng.sample(range(len(student_ids)), min(args.users, len(student_ids)))
+    clients = {}
+    reports = []
+
+    def login_job(index):
+        def job(recorder):
+            client = Client(port, recorder)
+            if client.login(f'student{index}@loadtest.example'):
+                clients[index] = client
+        return job
+    reports.append(run_phase('login', args.concurrency, [login_job(i) for i in users]))
+
+    def autosave_job(index):
+        def job(recorder):
+            client = clients[index]
+            client.recorder = recorder
+            job_rng = random.Random(args.seed * 100003 + index)
+            for _ in range(args.saves):
+                question_type = job_rng.choice(QUESTION_TYPES)
+                body = json.dumps({'lesson_slug': job_rng.choice(('coding', 'coding_al')),
+                                   'question_type': question_type,
+                                   'question_id': f'{question_type}_{job_rng.randrange(args.questions)}',
+                                   'student_answer': f'edit {job_rng.random():.6f}',
+                                   'is_correct': job_rng.random() < 0.5})
+                client.request('POST /api/response/save', 'POST', '/api/response/save', body=body,
+                               headers={'Content-Type': 'application/json'}, expect=(200, 202))
+        return job
+    reports.append(run_phase('autosave', args.concurrency, [autosave_job(i) for i in clients]))
+
+    def progress_job(index):
+        def job(recorder):
+            client = clients[index]
+            client.recorder = recorder
+            path = '/api/student/lesson/coding/progress'
+            _, headers, _ = client.request('GET progress (first load)', 'GET', path)
+            etag = headers.get('ETag')
+            for _ in range(args.reloads):
+                client.request('GET progress (revalidate)', 'GET', path,
+                               headers={'If-None-Match': etag} if etag else None, expect=(200, 304))
+        return job
+    reports.append(run_phase('progress', args.concurrency, [progress_job(i) for i in clients]))
+
+    def teacher_job(number):
+        def job(recorder):
+            client = Client(port, recorder)
+            auth = {'Authorization': TEACHER_AUTH}
+            cursor = None
+            while True:
+                query = {'limit': 50, **({'cursor': cursor} if cursor else {})}
+                status, _, data = client.request('GET /api/teacher/students', 'GET',
+                                                 f'/api/teacher/students?{urlencode(query)}', headers=auth)
+                if status != 200:
+                    break
+                cursor = json.loads(data).get('next_cursor')
+                if not cursor:
+                    break
+            job_rng = random.Random(args.seed * 7919 + number)
+            for _ in range(args.details):
+                client.request('GET /api/teacher/student/<id>/details', 'GET',
+                               f'/api/teacher/student/{job_rng.choice(student_ids)}/details', headers=auth)
+        return job
+    reports.append(run_phase('teacher', min(args.concurrency, args.teachers),
+                             [teacher_job(n) for n in range(args.teachers)]))
+    return reports
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return {'commit': revision, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    previous = {}
+    for phase in (baseline or {}).get('phases', []):
+        for label, stats in phase['endpoints'].items():
+            previous[(phase['phase'], label)] = stats
+    for phase in results['phases']:
+        print(f"\n{phase['phase']}: {phase['requests']} requests in {phase['duration_s']}s "
+              f"({phase['throughput_rps']} req/s)")
+        print(f"  {'endpoint':<40} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+        for label, stats in phase['endpoints'].items():
+            line = (f"  {label:<40} {stats['throughput_rps']:>8} {stats['p50_ms']:>8} "
+                    f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['errors']:>7}")
+            before = previous.get((phase['phase'], label))
+            if before and before['p95_ms']:
+                change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+                line += f"   p95 {change:+.0f}% vs baseline"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--students', type=int, default=500, help='students to seed')
+    parser.add_argument('--responses', type=int, default=40, help='seeded responses per student')
+    parser.add_argument('--questions', type=int, default=15, help='questions per type per lesson')
+    parser.add_argument('--users', type=int, default=200, help='students who take part in the traffic phases')
+    parser.add_argument('--saves', type=int, default=20, help='autosaves per student')
+    parser.add_argument('--reloads', type=int, default=10, help='progress revalidations per student')
+    parser.add_argument('--teachers', type=int, default=4, help='teacher dashboards')
+    parser.add_argument('--details', type=int, default=50, help='student detail views per teacher')
+    parser.add_argument('--concurrency', type=int, default=50, help='simultaneous clients')
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn'), default='gunicorn')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for data and traffic')
+    parser.add_argument('--pg-bin', help='directory holding initdb and pg_ctl (default: PATH)')
+    parser.add_argument('--use-server', action='store_true',
+                        help='use a scratch database on the PG* server instead of a temporary cluster')
+    parser.add_argument('--output', default='loadtest-results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='earlier results JSON to compare p95 latencies against')
+    args = parser.parse_args()
+
+    if args.use_server:
+        cluster = contextmanager(lambda: (yield {key: os.environ.get(key, '') for key in
+                                                 ('PGHOST', 'PGPORT', 'PGUSER', 'PGPASSWORD')}))()
+    else:
+        cluster = throwaway_cluster(args.pg_bin)
+    with cluster as server_env, scratch_database(server_env) as db_env:
+        os.environ.update(db_env)
+        print(f'Seeding {args.students} students ...', flush=True)
+        started = time.perf_counter()
+        student_ids, response_count = seed(args)
+        print(f'Seeded {response_count} responses in {time.perf_counter() - started:.1f}s; '
+              f'starting {args.server} with {args.workers} workers', flush=True)
+        with app_server(args, db_env) as port:
+            phases = drive(args, port, student_ids)
+
+    results = {
+        'meta': {
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'seeded_responses': response_count,
+        },
+        'phases': phases,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
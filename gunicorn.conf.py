@@ -0,0 +1,56 @@
+# Gunicorn settings for serving wsgi:app in production.
+# Every value can be overridden from the environment.
+import os
+import signal
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Threaded workers: autosaves and progress reads mostly wait on Postgres, and each
+# open teacher live-update stream holds one thread (for TEACHER_STREAM_MAX_AGE at most)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    # Runs in the master before any worker forks: check the database and load the
+    # lesson catalog (inherited by every worker), then close the connections so
+    # no socket is shared across processes.
+    import app
+    app.warm_up()
+    app.close_db_pool()
+    # Buffered autosaves are only visible to the worker holding them
+    app.write_buffer.require_single_process(server.cfg.workers)
+
+
+def post_fork(server, worker):
+    # Each worker opens its own pool before taking traffic
+    import app
+    app.get_db_pool()
+
+
+def post_worker_init(worker):
+    # Open live-update streams would keep a stopping worker busy for the whole
+    # graceful timeout, so SIGTERM ends them before the worker drains
+    import app
+    handle_exit = worker.handle_exit
+
+    def end_streams_and_exit(sig, frame):
+        app.teacher_events.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, end_streams_and_exit)
+
+
+def worker_exit(server, worker):
+    # Graceful shutdown: write out buffered autosaves and close the pool
+    import app
+    app.shutdown_services()
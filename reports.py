@@ -0,0 +1,75 @@
+# PDF progress reports, rendered server side (needs the "reports" extra from pyproject.toml).
+#
+# Kept out of app.py on purpose: reports are rendered on a process pool, and each
+# pool process imports only this module, not the Flask app and its services.
+from fpdf import FPDF
+
+TITLE = 'Programming Fundamentals Responses'
+
+def pdf_text(value):
+    # The built-in PDF fonts only cover Latin-1
+    return str(value).encode('latin-1', 'replace').decode('latin-1')
+
+def answer_lines(answer):
+    """Answers are JSON values: text, a list (timeline rows) or an object (matches)."""
+    if answer is None or answer == '' or answer == [] or answer == {}:
+        return ['No response.']
+    if isinstance(answer, dict):
+        return [f'{key}: {flatten(value)}' for key, value in answer.items()]
+    if isinstance(answer, list):
+        return [flatten(item) for item in answer]
+    return [str(answer)]
+
+def flatten(value):
+    if isinstance(value, dict):
+        return ', '.join(f'{key}: {flatten(item)}' for key, item in value.items())
+    if isinstance(value, list):
+        return ', '.join(flatten(item) for item in value)
+    return str(value)
+
+def render_report(student, lessons, as_of):
+    """One student's report as PDF bytes.
+
+    ``student`` is a dict with student_name, student_id, class_name and email;
+    ``lessons`` is a list of (lesson_title, responses), each response a dict as
+    returned by the teacher details API. ``as_of`` is the latest answer's
+    updated_at, so a report's content depends only on the data it shows.
+    """
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_title(pdf_text(f"{TITLE} - {student['student_name']}"))
+    pdf.add_page()
+
+    pdf.set_font('Helvetica', 'B', 18)
+    pdf.multi_cell(0, 10, pdf_text(TITLE), new_x='LMARGIN', new_y='NEXT')
+    pdf.set_font('Helvetica', '', 12)
+    details = [student['student_name']]
+    if student.get('student_id'):
+        details.append(f"Student ID {student['student_id']}")
+    if student.get('class_name'):
+        details.append(f"Class {student['class_name']}")
+    pdf.multi_cell(0, 7, pdf_text(' | '.join(details)), new_x='LMARGIN', new_y='NEXT')
+    if as_of is not None:
+        pdf.set_font('Helvetica', 'I', 10)
+        pdf.multi_cell(0, 6, f'Responses as of {as_of:%Y-%m-%d %H:%M}', new_x='LMARGIN', new_y='NEXT')
+
+    if not lessons:
+        pdf.ln(5)
+        pdf.set_font('Helvetica', '', 12)
+        pdf.multi_cell(0, 7, 'No responses yet.', new_x='LMARGIN', new_y='NEXT')
+
+    for lesson_title, responses in lessons:
+        pdf.ln(5)
+        pdf.set_font('Helvetica', 'B', 14)
+        pdf.multi_cell(0, 8, pdf_text(lesson_title), new_x='LMARGIN', new_y='NEXT')
+        for response in responses:
+            mark = {True: ' (correct)', False: ' (incorrect)'}.get(response['is_correct'], '')
+            pdf.set_font('Helvetica', 'B', 11)
+            heading = f"{response['question_type'].capitalize()}: {response['question_id']}{mark}"
+            pdf.multi_cell(0, 6, pdf_text(heading), new_x='LMARGIN', new_y='NEXT')
+            pdf.set_font('Helvetica', '', 11)
+            for line in answer_lines(response['student_answer']):
+                pdf.multi_cell(0, 6, pdf_text(line), new_x='LMARGIN', new_y='NEXT')
+            pdf.ln(2)
+
+    return bytes(pdf.output())